@@ -0,0 +1,147 @@
+import atexit
+import os
+import sys
+import threading
+from time import monotonic
+
+from pymysql.err import InterfaceError, OperationalError
+
+from metrics import record_db_write
+from mysql_pool import get_mysql_pool
+
+_batch_writers = {}
+_batch_writers_lock = threading.Lock()
+
+
+class BatchWriter:
+    """Buffers rows for one table and writes them with multi-row INSERTs.
+
+    Rows are flushed every `batch_size` rows or every `flush_interval`
+    seconds, whichever comes first, with a single commit per flush.  A batch
+    that fails on a lost connection is kept for the next flush; one that
+    fails otherwise is written row by row and the failing rows are dropped.
+    """
+
+    def __init__(self, table, columns, update_columns=(), batch_size=500,
+                 flush_interval=1.0):
+        self.table = table
+        self.sql = "INSERT INTO `" + table + "` (" + ", ".join(
+            "`" + column + "`" for column in columns) + ") VALUES (" + ", ".join(
+                ["%s"] * len(columns)) + ")"
+
+        if update_columns:
+            self.sql += " ON DUPLICATE KEY UPDATE " + ", ".join(
+                "`" + column + "` = VALUES(`" + column + "`)"
+                for column in update_columns)
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pool = get_mysql_pool()
+        self.rows = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.closed = threading.Event()
+        self.timer = None
+
+    def add(self, *row):
+        with self.lock:
+            self.rows.append(row)
+            full = len(self.rows) >= self.batch_size
+
+            if self.timer is None:
+                self.timer = threading.Thread(
+                    target=self.flush_periodically, daemon=True)
+                self.timer.start()
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                rows, self.rows = self.rows, []
+
+            if not rows:
+                return
+
+            started = monotonic()
+            try:
+                with self.pool.connection() as connection:
+                    with connection.cursor() as cursor:
+                        cursor.executemany(self.sql, rows)
+                    connection.commit()
+            except (OperationalError, InterfaceError):
+                record_db_write(self.table, len(rows), monotonic() - started,
+                                failed=True)
+                # Keep the rows for the next flush
+                self.requeue(rows)
+                raise
+            except Exception:
+                record_db_write(self.table, len(rows), monotonic() - started,
+                                failed=True)
+                # A row that can never be written must not hold back the rest
+                self.write_each(rows)
+                return
+
+            record_db_write(self.table, len(rows), monotonic() - started)
+
+    def requeue(self, rows):
+        with self.lock:
+            self.rows[:0] = rows
+
+    def write_each(self, rows):
+        """Write the rows of a failed batch one at a time, dropping bad rows."""
+        for index, row in enumerate(rows):
+            started = monotonic()
+            try:
+                with self.pool.connection() as connection:
+                    with connection.cursor() as cursor:
+                        cursor.execute(self.sql, row)
+                    connection.commit()
+            except (OperationalError, InterfaceError):
+                self.requeue(rows[index:])
+                raise
+            except Exception as error:
+                record_db_write(self.table, 1, monotonic() - started,
+                                failed=True)
+                print("Dropped row:", self.table, row[:1], repr(error),
+                      file=sys.stderr)
+                continue
+
+            record_db_write(self.table, 1, monotonic() - started)
+
+    def flush_periodically(self):
+        while not self.closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                print("Flush failed:", sys.exc_info()[0], file=sys.stderr)
+
+    def close(self):
+        self.closed.set()
+        self.flush()
+
+
+def get_batch_writer(table, columns, update_columns=()):
+    writer_key = (table, tuple(columns), tuple(update_columns))
+
+    with _batch_writers_lock:
+        batch_writer = _batch_writers.get(writer_key)
+        if batch_writer is None:
+            batch_size = int(os.environ.get("MYSQL_BATCH_SIZE") or 500)
+            flush_interval = int(
+                os.environ.get("MYSQL_FLUSH_INTERVAL_MS") or 1000) / 1000
+            batch_writer = BatchWriter(table, columns, update_columns,
+                                       batch_size, flush_interval)
+            _batch_writers[writer_key] = batch_writer
+            atexit.register(batch_writer.close)
+
+    return batch_writer
+
+
+def flush_all():
+    with _batch_writers_lock:
+        batch_writers = list(_batch_writers.values())
+
+    for batch_writer in batch_writers:
+        batch_writer.flush()
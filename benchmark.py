@@ -0,0 +1,229 @@
+import argparse
+import io
+import os
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from os.path import join
+from time import perf_counter
+
+import numpy as np
+
+from batch_writer import flush_all
+from mock_places_server import (mock_photo_reference, mock_place_id,
+                                start_server)
+from mysql_pool import get_mysql_pool
+
+"""
+Drives radar_search.py, place_details_from_file.py and
+place_photo_from_file.py against mock_places_server.py and a scratch MySQL
+database, e.g. `docker run -e MYSQL_ALLOW_EMPTY_PASSWORD=1 -e
+MYSQL_DATABASE=bench -p 3306:3306 mysql:8` with MYSQL_HOST=127.0.0.1,
+MYSQL_USER=root and MYSQL_DB=bench.  The bench_* tables are created and
+emptied before every stage.
+"""
+
+BENCHMARK_TABLES = {
+    'RADAR_SEARCHS_TABLE': 'bench_radar_searchs',
+    'RADAR_SEARCHS_FAILED_TABLE': 'bench_radar_searchs_failed',
+    'PLACE_DETAILS_TABLE': 'bench_place_details',
+    'PLACE_DETAILS_FAILED_TABLE': 'bench_place_details_failed',
+    'PLACE_PHOTO_REFERENCES_TABLE': 'bench_place_photo_references',
+    'PLACE_PHOTOS_TABLE': 'bench_place_photos',
+    'PLACE_PHOTOS_FAILED_TABLE': 'bench_place_photos_failed',
+}
+
+RADAR_SEARCHS_SCHEMA = " (`id` bigint unsigned NOT NULL AUTO_INCREMENT, `location` varchar(255) NOT NULL, `radius` int NOT NULL, `type` varchar(255) NOT NULL, `results` json DEFAULT NULL, `created_at` timestamp NULL DEFAULT NULL, `updated_at` timestamp NULL DEFAULT NULL, PRIMARY KEY (`id`)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+PLACE_DETAILS_SCHEMA = " (`id` bigint unsigned NOT NULL AUTO_INCREMENT, `place_id` varchar(255) NOT NULL, `language` varchar(255) NOT NULL, `results` json DEFAULT NULL, `results_compressed` mediumblob DEFAULT NULL, `created_at` timestamp NULL DEFAULT NULL, `updated_at` timestamp NULL DEFAULT NULL, PRIMARY KEY (`id`), UNIQUE KEY `place_id` (`place_id`, `language`)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+PLACE_PHOTO_REFERENCES_SCHEMA = " (`id` bigint unsigned NOT NULL AUTO_INCREMENT, `place_id` varchar(255) NOT NULL, `language` varchar(255) NOT NULL, `photo_reference` varchar(255) NOT NULL, `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (`id`), UNIQUE KEY `photo_reference` (`photo_reference`, `place_id`, `language`)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+PLACE_PHOTOS_SCHEMA = " (`id` bigint unsigned NOT NULL AUTO_INCREMENT, `photo_reference` varchar(255) NOT NULL, `results` text, `created_at` timestamp NULL DEFAULT NULL, `updated_at` timestamp NULL DEFAULT NULL, PRIMARY KEY (`id`), KEY `photo_reference` (`photo_reference`)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+
+SCHEMAS = {
+    'bench_radar_searchs': RADAR_SEARCHS_SCHEMA,
+    'bench_radar_searchs_failed': RADAR_SEARCHS_SCHEMA,
+    'bench_place_details': PLACE_DETAILS_SCHEMA,
+    'bench_place_details_failed': PLACE_DETAILS_SCHEMA,
+    'bench_place_photo_references': PLACE_PHOTO_REFERENCES_SCHEMA,
+    'bench_place_photos': PLACE_PHOTOS_SCHEMA,
+    'bench_place_photos_failed': PLACE_PHOTOS_SCHEMA,
+}
+
+
+def apply_env(env, modules):
+    """Set `env` again after the scripts' load_dotenv, and their constants."""
+    os.environ.update(env)
+
+    for module in modules:
+        for name, value in env.items():
+            if hasattr(module, name):
+                setattr(module, name, value)
+
+        if hasattr(module, 'PLACE_TYPES'):
+            module.PLACE_TYPES = env['PLACE_TYPES'].split(",")
+
+
+def reset_tables(tables):
+    with get_mysql_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute("CREATE TABLE IF NOT EXISTS `" + table + "`" +
+                               SCHEMAS[table])
+                cursor.execute("TRUNCATE TABLE `" + table + "`")
+        connection.commit()
+
+
+def count_rows(tables):
+    count = 0
+    with get_mysql_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute("SELECT COUNT(*) AS `count` FROM `" + table + "`")
+                count += cursor.fetchone()['count']
+
+    return count
+
+
+def run_stage(name, server, module, function_name, argv, tables, verbose):
+    """Run module.main() with `argv`, timing every call of `function_name`."""
+    reset_tables(tables)
+
+    latencies = []
+    request = getattr(module, function_name)
+
+    def timed_request(*args):
+        started = perf_counter()
+        try:
+            return request(*args)
+        finally:
+            latencies.append(perf_counter() - started)
+
+    setattr(module, function_name, timed_request)
+    sys.argv = [module.__file__] + argv
+    server_requests = server.request_count
+    output = sys.stdout if verbose else io.StringIO()
+
+    started = perf_counter()
+    try:
+        with redirect_stdout(output):
+            module.main()
+            flush_all()
+    finally:
+        setattr(module, function_name, request)
+    elapsed = perf_counter() - started
+
+    rows = count_rows(tables)
+    latencies_ms = np.array(latencies) * 1000
+
+    print("== " + name + " ==")
+    print("  calls:", len(latencies_ms), "HTTP requests:",
+          server.request_count - server_requests, "seconds:",
+          round(elapsed, 2))
+    print("  requests/sec:", round(len(latencies_ms) / elapsed, 1))
+    if len(latencies_ms):
+        print("  latency ms p50:",
+              round(float(np.percentile(latencies_ms, 50)), 1), "p99:",
+              round(float(np.percentile(latencies_ms, 99)), 1))
+    print("  rows written:", rows, "rows/sec:", round(rows / elapsed, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-n', help='The number of place details and photos to fetch', default='2000')
+    parser.add_argument(
+        '-c', help='The number of requests kept in flight', default='16')
+    parser.add_argument(
+        '--area', help='The side in meters of the radar search area', default='3000')
+    parser.add_argument('-r', help='The radar search radius', default='500')
+    parser.add_argument(
+        '--keys', help='The number of mock API keys', default='4')
+    parser.add_argument(
+        '--qps', help='GOOGLE_PLACES_QPS of every mock key', default='1000')
+    parser.add_argument(
+        '--latency', help='The mean mock latency in ms', default='50')
+    parser.add_argument(
+        '--jitter', help='The standard deviation of the latency in ms', default='10')
+    parser.add_argument(
+        '--error-rate', help='The share of HTTP 500 responses', default='0')
+    parser.add_argument(
+        '--over-query-limit-rate',
+        help='The share of OVER_QUERY_LIMIT responses',
+        default='0')
+    parser.add_argument(
+        '--stages', help='The stages to run', default='radar,details,photos')
+    parser.add_argument(
+        '--verbose', help='Keep the output of the scripts', action='store_true')
+    args = parser.parse_args()
+
+    server = start_server(
+        latency=float(args.latency) / 1000,
+        jitter=float(args.jitter) / 1000,
+        error_rate=float(args.error_rate),
+        over_query_limit_rate=float(args.over_query_limit_rate))
+
+    work_dir = tempfile.mkdtemp(prefix='places-benchmark-')
+    place_ids_file = join(work_dir, 'place_ids.txt')
+    photo_references_file = join(work_dir, 'photo_references.txt')
+    n = int(args.n)
+
+    with open(place_ids_file, 'w') as output_file:
+        output_file.writelines(mock_place_id(str(i)) + "\n" for i in range(n))
+
+    with open(photo_references_file, 'w') as output_file:
+        output_file.writelines(
+            mock_photo_reference(str(i)) + "\n" for i in range(n))
+
+    env = dict(BENCHMARK_TABLES)
+    env.update({
+        'GOOGLE_MAPS_BASE_URL': "http://127.0.0.1:" + str(server.server_port),
+        'GOOGLE_PLACES_API_KEYS': ",".join(
+            "AIzaMockKey" + str(i) for i in range(int(args.keys))),
+        'GOOGLE_PLACES_QPS': args.qps,
+        'GOOGLE_PLACES_DAILY_QUOTA': '0',
+        'PLACE_TYPES': 'restaurant,cafe',
+        'PLACE_DETAILS_LANG': 'id',
+        'PLACE_DETAILS_FILE': place_ids_file,
+        'PLACE_PHOTOS_FILE': photo_references_file,
+        'RESPONSE_CACHE_PATH': '',
+    })
+    os.environ.update(env)
+
+    import place_details_from_file
+    import place_photo_from_file
+    import radar_search
+
+    apply_env(env, (radar_search, place_details_from_file,
+                    place_photo_from_file))
+
+    stages = args.stages.split(",")
+    lat_offset = radar_search.meters_to_lat(float(args.area))
+    lng_offset = radar_search.meters_to_lng(float(args.area), -6.2)
+
+    if 'radar' in stages:
+        run_stage("radar_search.py --hex", server, radar_search,
+                  'get_radar_result', [
+                      '--lat1', '-6.2', '--lng1', '106.8', '--lat2',
+                      str(-6.2 + lat_offset), '--lng2',
+                      str(106.8 + lng_offset), '-r', args.r, '--hex'
+                  ], ['bench_radar_searchs', 'bench_radar_searchs_failed'],
+                  args.verbose)
+
+    if 'details' in stages:
+        run_stage("place_details_from_file.py", server,
+                  place_details_from_file, 'get_place_details_result',
+                  ['-c', args.c], [
+                      'bench_place_details', 'bench_place_details_failed',
+                      'bench_place_photo_references'
+                  ], args.verbose)
+
+    if 'photos' in stages:
+        run_stage("place_photo_from_file.py", server, place_photo_from_file,
+                  'get_place_photos_result', ['-c', args.c],
+                  ['bench_place_photos', 'bench_place_photos_failed'],
+                  args.verbose)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
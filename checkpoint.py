@@ -0,0 +1,105 @@
+import argparse
+import os
+import threading
+from time import monotonic
+
+
+class CheckpointJournal:
+    """Append-only journal of the (cell index, place type) pairs already done.
+
+    Every entry is one "cell<TAB>type" line.  Lines are fsynced in batches,
+    and `before_sync` runs first so that the results a line stands for reach
+    the database before the line itself becomes durable.  A partial last line
+    left by a crash is ignored, so the file can be read at any time.
+    """
+
+    def __init__(self, path, plan, sync_every=100, sync_interval=1.0,
+                 before_sync=None):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.before_sync = before_sync
+        self.done = {}
+        self.pending = 0
+        self.synced_at = monotonic()
+        self.lock = threading.Lock()
+
+        header = "# plan " + plan
+
+        if os.path.exists(path):
+            with open(path, 'rb') as journal_file:
+                lines = journal_file.read().split(b"\n")
+
+            if lines[0] and lines[0].decode('utf-8') != header:
+                raise ValueError("The journal " + path +
+                                 " belongs to another plan: " +
+                                 lines[0].decode('utf-8'))
+
+            for line in lines[1:-1]:
+                if line:
+                    self.add(line.decode('utf-8'))
+
+            # Drop the partial line left by a crash
+            if lines[-1]:
+                os.truncate(path, os.path.getsize(path) - len(lines[-1]))
+
+        self.file = open(path, 'a')
+        if self.file.tell() == 0:
+            self.file.write(header + "\n")
+        self.sync()
+
+    def add(self, line):
+        cell_index, place_type = line.split("\t")
+        self.done.setdefault(int(cell_index), set()).add(place_type)
+
+    def is_done(self, cell_index, place_type):
+        return place_type in self.done.get(cell_index, ())
+
+    def is_cell_done(self, cell_index, place_types):
+        return set(place_types) <= self.done.get(cell_index, set())
+
+    def mark(self, cell_index, place_type):
+        with self.lock:
+            self.done.setdefault(cell_index, set()).add(place_type)
+            self.file.write(str(cell_index) + "\t" + place_type + "\n")
+            self.pending += 1
+
+            if (self.pending >= self.sync_every or
+                    monotonic() - self.synced_at >= self.sync_interval):
+                self.sync()
+
+    def sync(self):
+        if self.before_sync is not None:
+            self.before_sync()
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+        self.synced_at = monotonic()
+
+    def close(self):
+        with self.lock:
+            self.sync()
+            self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('journal', help='The checkpoint journal to summarize')
+    args = parser.parse_args()
+
+    entries = 0
+    cells = set()
+    with open(args.journal) as journal_file:
+        header = journal_file.readline().strip()
+        for line in journal_file:
+            if line.endswith("\n"):
+                entries += 1
+                cells.add(line.split("\t")[0])
+
+    print(header)
+    print("Done:", entries, "cell types in", len(cells), "cells")
+
+
+if __name__ == "__main__":
+    main()
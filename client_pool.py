@@ -0,0 +1,102 @@
+import math
+import os
+import threading
+
+import googlemaps
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limiter import get_qps
+from retry import get_retry_budget
+
+_client_pool = None
+_client_pool_lock = threading.Lock()
+
+
+def get_base_url():
+    """The API host, overridden with GOOGLE_MAPS_BASE_URL for a mock server."""
+    return (os.environ.get("GOOGLE_MAPS_BASE_URL") or
+            "https://maps.googleapis.com").rstrip("/")
+
+
+class Client(googlemaps.Client):
+    """A googlemaps.Client whose requests go to `base_url`."""
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def _request(self, url, params, *args, **kwargs):
+        # Retries pass base_url on positionally
+        if len(args) < 3:
+            kwargs.setdefault('base_url', self.base_url)
+        return super()._request(url, params, *args, **kwargs)
+
+
+class ClientPool:
+    """One long-lived googlemaps.Client and requests.Session per API key.
+
+    Both keep their HTTP connections alive and can be shared across worker
+    threads; the connection pools are sized for `pool_maxsize` concurrent
+    requests per key so that threads don't throw away idle connections.
+    """
+
+    def __init__(self, pool_maxsize=32, base_url="https://maps.googleapis.com",
+                 retry_timeout=60, queries_per_second=50):
+        self.pool_maxsize = pool_maxsize
+        self.base_url = base_url
+        self.retry_timeout = retry_timeout
+        self.queries_per_second = queries_per_second
+        self.clients = {}
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def mount(self, session):
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_maxsize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+    def get_gmaps(self, key):
+        with self.lock:
+            gmaps = self.clients.get(key)
+            if gmaps is None:
+                # The client's own retries of 5xx responses must not outlast
+                # the retry budget of the item
+                gmaps = Client(
+                    self.base_url,
+                    key=key,
+                    retry_timeout=self.retry_timeout,
+                    queries_per_second=self.queries_per_second,
+                    retry_over_query_limit=False)
+                self.mount(gmaps.session)
+                self.clients[key] = gmaps
+
+        return gmaps
+
+    def get_session(self, key):
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                self.mount(session)
+                self.sessions[key] = session
+
+        return session
+
+
+def get_client_pool():
+    global _client_pool
+
+    with _client_pool_lock:
+        if _client_pool is None:
+            pool_maxsize = int(os.environ.get("HTTP_POOL_MAXSIZE") or 32)
+            # The rate limiter already throttles every key; within a second
+            # its bucket lets through a full burst plus the refill, so the
+            # client's own throttle must allow both to never apply
+            qps = get_qps()
+            queries_per_second = int(math.ceil(max(1.0, qps) + qps))
+            _client_pool = ClientPool(pool_maxsize, get_base_url(),
+                                      get_retry_budget(), queries_per_second)
+
+    return _client_pool
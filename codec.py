@@ -0,0 +1,52 @@
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+PLACE_ID_PATTERN = re.compile(r'"place_id"\s*:\s*"([^"\\]*)"')
+PHOTO_REFERENCE_PATTERN = re.compile(r'"photo_reference"\s*:\s*"([^"\\]*)"')
+
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+
+    if ujson is not None:
+        return ujson.dumps(obj, ensure_ascii=False)
+
+    return json.dumps(obj)
+
+
+def loads(payload):
+    if orjson is not None:
+        return orjson.loads(payload)
+
+    if ujson is not None:
+        return ujson.loads(payload)
+
+    return json.loads(payload)
+
+
+def to_text(payload):
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return bytes(payload).decode('utf-8')
+
+    return payload
+
+
+def extract_place_ids(payload):
+    """The place_ids of a stored radar search payload, without parsing it."""
+    return PLACE_ID_PATTERN.findall(to_text(payload))
+
+
+def extract_photo_references(payload):
+    """The photo references of a stored place details payload."""
+    return PHOTO_REFERENCE_PATTERN.findall(to_text(payload))
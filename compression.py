@@ -0,0 +1,188 @@
+import argparse
+import os
+import struct
+import threading
+import zlib
+from os.path import dirname, join
+
+from dotenv import load_dotenv
+
+from mysql_pool import get_mysql_pool
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""
+ALTER TABLE `place_details`
+  MODIFY `results` json DEFAULT NULL,
+  ADD `results_compressed` mediumblob DEFAULT NULL;
+
+CREATE TABLE `compression_dictionaries` (
+  `id` int unsigned NOT NULL AUTO_INCREMENT,
+  `dictionary` mediumblob NOT NULL,
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+"""
+
+# Every compressed value starts with a format byte and the dictionary ID
+ZSTD_FORMAT = b'Z'
+ZLIB_FORMAT = b'z'
+HEADER = struct.Struct('>cI')
+
+_dictionaries = {}
+_zstd_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+
+
+def get_dictionary(dictionary_id):
+    if dictionary_id == 0:
+        return None
+
+    with _dictionaries_lock:
+        dictionary = _dictionaries.get(dictionary_id)
+        if dictionary is None:
+            with get_mysql_pool().connection() as connection:
+                with connection.cursor() as cursor:
+                    sql = "SELECT `dictionary` FROM `" + get_dictionaries_table() + "` WHERE `id`=%s"
+                    cursor.execute(sql, (dictionary_id, ))
+                    row = cursor.fetchone()
+
+            if row is None:
+                raise ValueError("Unknown compression dictionary: " +
+                                 str(dictionary_id))
+
+            dictionary = bytes(row['dictionary'])
+            _dictionaries[dictionary_id] = dictionary
+
+    return dictionary
+
+
+def get_zstd_dictionary(dictionary_id):
+    dictionary = get_dictionary(dictionary_id)
+    if dictionary is None:
+        return None
+
+    with _dictionaries_lock:
+        zstd_dictionary = _zstd_dictionaries.get(dictionary_id)
+        if zstd_dictionary is None:
+            zstd_dictionary = zstandard.ZstdCompressionDict(dictionary)
+            zstd_dictionary.precompute_compress(level=9)
+            _zstd_dictionaries[dictionary_id] = zstd_dictionary
+
+    return zstd_dictionary
+
+
+def get_dictionaries_table():
+    return os.environ.get(
+        "COMPRESSION_DICTIONARIES_TABLE") or "compression_dictionaries"
+
+
+def get_compression():
+    return (os.environ.get("PLACE_DETAILS_COMPRESSION") or "").lower()
+
+
+def is_compression_enabled():
+    return get_compression() in ('zstd', 'zlib')
+
+
+def compress_results(payload):
+    algorithm = get_compression()
+    dictionary_id = int(os.environ.get("PLACE_DETAILS_DICTIONARY_ID") or 0)
+    data = payload.encode('utf-8')
+
+    if algorithm == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("PLACE_DETAILS_COMPRESSION=zstd needs zstandard")
+
+        compressor = zstandard.ZstdCompressor(
+            level=9, dict_data=get_zstd_dictionary(dictionary_id))
+        return HEADER.pack(ZSTD_FORMAT, dictionary_id) + compressor.compress(data)
+
+    dictionary = get_dictionary(dictionary_id)
+    if dictionary is not None:
+        compressor = zlib.compressobj(9, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(9)
+
+    return HEADER.pack(ZLIB_FORMAT, dictionary_id) + compressor.compress(
+        data) + compressor.flush()
+
+
+def decompress_results(blob):
+    blob = bytes(blob)
+    data_format, dictionary_id = HEADER.unpack_from(blob)
+    data = blob[HEADER.size:]
+
+    if data_format == ZSTD_FORMAT:
+        if zstandard is None:
+            raise RuntimeError("Decompressing zstd results needs zstandard")
+
+        decompressor = zstandard.ZstdDecompressor(
+            dict_data=get_zstd_dictionary(dictionary_id))
+        return decompressor.decompress(data).decode('utf-8')
+
+    if data_format == ZLIB_FORMAT:
+        dictionary = get_dictionary(dictionary_id)
+        if dictionary is not None:
+            decompressor = zlib.decompressobj(zdict=dictionary)
+        else:
+            decompressor = zlib.decompressobj()
+
+        return (decompressor.decompress(data) +
+                decompressor.flush()).decode('utf-8')
+
+    raise ValueError("Unknown results format: " + repr(data_format))
+
+
+def decode_results(row):
+    """The JSON text of a place_details row, stored compressed or not."""
+    if row.get('results_compressed') is not None:
+        return decompress_results(row['results_compressed'])
+
+    return row['results']
+
+
+def train_dictionary(samples, size):
+    if zstandard is not None:
+        return zstandard.train_dictionary(size, samples).as_bytes()
+
+    # zlib only looks back 32 KB, so its dictionary is the most typical tail
+    return b"".join(samples)[-min(size, 32768):]
+
+
+def main():
+    dotenv_path = join(dirname(__file__), '.env')
+    load_dotenv(dotenv_path, override=True)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-n', help='The number of place details to train on', default='2000')
+    parser.add_argument(
+        '--size', help='The dictionary size in bytes', default='112640')
+    args = parser.parse_args()
+
+    with get_mysql_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            sql = "SELECT `results` FROM `" + os.environ.get(
+                "PLACE_DETAILS_TABLE") + "` WHERE `results` IS NOT NULL ORDER BY RAND() LIMIT %s"
+            cursor.execute(sql, (int(args.n), ))
+            samples = [row['results'].encode('utf-8') for row in cursor]
+
+    dictionary = train_dictionary(samples, int(args.size))
+
+    with get_mysql_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            sql = "INSERT INTO `" + get_dictionaries_table() + "` (`dictionary`) VALUES (%s)"
+            cursor.execute(sql, (dictionary, ))
+            dictionary_id = cursor.lastrowid
+        connection.commit()
+
+    print("Trained a", len(dictionary), "byte dictionary from", len(samples),
+          "samples; set PLACE_DETAILS_DICTIONARY_ID =", dictionary_id)
+
+
+if __name__ == "__main__":
+    main()
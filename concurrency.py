@@ -0,0 +1,37 @@
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from rate_limiter import QuotaExhaustedError
+
+
+def run_bounded(func, items, concurrency):
+    """Call func(item) for every item with at most `concurrency` calls in flight."""
+    if concurrency <= 1:
+        for item in items:
+            func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        for item in items:
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _check_done(done)
+
+            pending.add(executor.submit(func, item))
+
+        done, _ = wait(pending)
+        _check_done(done)
+
+
+def _check_done(done):
+    for future in done:
+        error = future.exception()
+        if error is None:
+            continue
+
+        # No item can be requested any more, so stop submitting them
+        if isinstance(error, QuotaExhaustedError):
+            raise error
+
+        print("Unexpected error:", repr(error), file=sys.stderr)
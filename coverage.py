@@ -0,0 +1,169 @@
+import json
+import math
+
+import numpy as np
+
+METERS_PER_DEGREE = 111320
+
+
+def hex_centers(lat_start, lng_start, lat_end, lng_end, radius):
+    """Circle centers of a hexagonal covering of the box, `radius` in meters.
+
+    Rows are 1.5 * radius apart and circles sqrt(3) * radius apart within a
+    row, every other row shifted by half a spacing.  The longitude spacing is
+    corrected for the latitude of each row.  Returns two arrays (lats, lngs).
+    """
+    if lat_start > lat_end:
+        lat_start, lat_end = lat_end, lat_start
+
+    if lng_start > lng_end:
+        lng_start, lng_end = lng_end, lng_start
+
+    radius_lat = radius / METERS_PER_DEGREE
+    row_step = 1.5 * radius_lat
+    row_count = int(math.ceil((lat_end - lat_start + radius_lat) / row_step)) + 1
+    rows = np.arange(row_count)
+    lats = lat_start + rows * row_step
+
+    # Longitude degrees shrink towards the poles
+    col_steps = math.sqrt(3) * radius / (
+        METERS_PER_DEGREE * np.cos(np.radians(lats)))
+    offsets = np.where(rows % 2 == 1, col_steps / 2, 0.0)
+    col_count = int(math.ceil((lng_end - lng_start) / col_steps.min())) + 3
+    cols = np.arange(-1, col_count - 1)
+
+    center_lats = np.broadcast_to(lats[:, None], (row_count, col_count))
+    center_lngs = lng_start + offsets[:, None] + cols[None, :] * col_steps[:, None]
+
+    # Keep the circles whose hexagonal cell reaches into the box
+    half_steps = col_steps[:, None] / 2
+    mask = ((center_lngs >= lng_start - half_steps) &
+            (center_lngs <= lng_end + half_steps) &
+            (center_lats <= lat_end + radius_lat))
+
+    return center_lats[mask], center_lngs[mask]
+
+
+def grid_centers(lat_start, lng_start, lat_end, lng_end, lat_step, lng_step):
+    lats = np.arange(lat_start, lat_end, lat_step)
+    lngs = np.arange(lng_start, lng_end, lng_step)
+    center_lats, center_lngs = np.meshgrid(lats, lngs, indexing='ij')
+    return center_lats.ravel(), center_lngs.ravel()
+
+
+def cell_centers(lat_start, lng_start, lat_end, lng_end, cell_size):
+    """Centers of square cells of `cell_size` meters tiling the box."""
+    half_lat = cell_size / 2 / METERS_PER_DEGREE
+    lats = np.arange(lat_start, lat_end, cell_size / METERS_PER_DEGREE) + half_lat
+
+    center_lats = []
+    center_lngs = []
+    for lat in lats:
+        lng_step = cell_size / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+        lngs = np.arange(lng_start, lng_end, lng_step) + lng_step / 2
+        center_lats.append(np.full(len(lngs), lat))
+        center_lngs.append(lngs)
+
+    if not center_lats:
+        return np.empty(0), np.empty(0)
+
+    return np.concatenate(center_lats), np.concatenate(center_lngs)
+
+
+def load_polygons(path):
+    """Read a GeoJSON (Multi)Polygon as a list of polygons of rings.
+
+    Every ring is an (n, 2) array of [lng, lat] vertices.
+    """
+    with open(path) as geojson_file:
+        geojson = json.load(geojson_file)
+
+    if geojson['type'] == 'FeatureCollection':
+        geometries = [feature['geometry'] for feature in geojson['features']]
+    elif geojson['type'] == 'Feature':
+        geometries = [geojson['geometry']]
+    else:
+        geometries = [geojson]
+
+    polygons = []
+    for geometry in geometries:
+        if geometry['type'] == 'Polygon':
+            coordinates = [geometry['coordinates']]
+        elif geometry['type'] == 'MultiPolygon':
+            coordinates = geometry['coordinates']
+        else:
+            raise ValueError("Unsupported geometry type: " + geometry['type'])
+
+        for rings in coordinates:
+            polygons.append([
+                np.asarray(ring, dtype=float)[:, :2] for ring in rings
+            ])
+
+    return polygons
+
+
+def circles_intersect(lats, lngs, radius, polygons):
+    """Mask of the circles that overlap any of the polygons.
+
+    A circle overlaps a polygon when its center is inside it (even-odd rule,
+    so holes are honoured) or when any edge passes within `radius` meters of
+    the center.  Coordinates are projected to meters around the mean latitude.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    radius = np.broadcast_to(np.asarray(radius, dtype=float), lats.shape)
+
+    scale_x = METERS_PER_DEGREE * math.cos(math.radians(lats.mean())) if len(
+        lats) else METERS_PER_DEGREE
+    xs = lngs * scale_x
+    ys = lats * METERS_PER_DEGREE
+    radius_squared = radius**2
+
+    mask = np.zeros(len(lats), dtype=bool)
+    for rings in polygons:
+        inside = np.zeros(len(lats), dtype=bool)
+        near = np.zeros(len(lats), dtype=bool)
+
+        for ring in rings:
+            ring_xs = ring[:, 0] * scale_x
+            ring_ys = ring[:, 1] * METERS_PER_DEGREE
+
+            for x1, y1, x2, y2 in zip(ring_xs, ring_ys, np.roll(ring_xs, -1),
+                                      np.roll(ring_ys, -1)):
+                # Ray casting towards +x
+                if y1 != y2:
+                    crosses = (y1 > ys) != (y2 > ys)
+                    x_cross = x1 + (ys - y1) * (x2 - x1) / (y2 - y1)
+                    inside ^= crosses & (xs < x_cross)
+
+                # Distance from the centers to the edge
+                dx = x2 - x1
+                dy = y2 - y1
+                length_squared = dx * dx + dy * dy
+                if length_squared > 0:
+                    t = np.clip(
+                        ((xs - x1) * dx + (ys - y1) * dy) / length_squared, 0,
+                        1)
+                else:
+                    t = 0
+                distance_squared = (xs - x1 - t * dx)**2 + (ys - y1 - t * dy)**2
+                near |= distance_squared <= radius_squared
+
+        mask |= inside | near
+
+    return mask
+
+
+def box_area(lat_start, lng_start, lat_end, lng_end):
+    height = abs(lat_end - lat_start) * METERS_PER_DEGREE
+    mean_lat = math.radians((lat_start + lat_end) / 2)
+    width = abs(lng_end - lng_start) * METERS_PER_DEGREE * math.cos(mean_lat)
+    return height * width
+
+
+def overlap_ratio(circle_count, radius, area):
+    """Searched area over target area; 1.0 would be a perfect tiling."""
+    if area <= 0:
+        return float('inf')
+
+    return circle_count * math.pi * radius**2 / area
@@ -0,0 +1,59 @@
+import heapq
+import tempfile
+from itertools import groupby
+
+
+def write_run(items):
+    run = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+    run.writelines(item + "\n" for item in sorted(items))
+    run.seek(0)
+    return run
+
+
+def read_run(run, tag):
+    for line in run:
+        yield (line[:-1], tag)
+
+
+def iter_unique(items, max_in_memory=1000000):
+    """Yield every distinct string of `items` once.
+
+    Items are yielded as they are first seen while at most `max_in_memory`
+    of them are distinct.  Past that the seen items are spilled to a sorted
+    run on disk, the rest are sorted into more runs of that size, and the
+    runs are merged; the remaining items then come out in sorted order.
+    """
+    seen = set()
+    iterator = iter(items)
+
+    for item in iterator:
+        if item in seen:
+            continue
+
+        seen.add(item)
+        yield item
+
+        if len(seen) >= max_in_memory:
+            break
+    else:
+        return
+
+    print("More than", max_in_memory, "unique items, sorting on disk...")
+
+    # Tag 0 sorts first and marks the items that were already yielded
+    runs = [read_run(write_run(seen), 0)]
+    seen = set()
+
+    for item in iterator:
+        seen.add(item)
+        if len(seen) >= max_in_memory:
+            runs.append(read_run(write_run(seen), 1))
+            seen = set()
+
+    if seen:
+        runs.append(read_run(write_run(seen), 1))
+    seen = None
+
+    for item, tagged in groupby(heapq.merge(*runs), key=lambda pair: pair[0]):
+        if next(tagged)[1] != 0:
+            yield item
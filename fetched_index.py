@@ -0,0 +1,126 @@
+import math
+import threading
+from datetime import datetime
+from hashlib import blake2b
+
+import pymysql.cursors
+
+from mysql_pool import get_mysql_pool
+
+_fetched_indexes = {}
+_fetched_indexes_lock = threading.Lock()
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) /
+                               (math.log(2)**2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, key):
+        digest = blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self.positions(key))
+
+
+class FetchedIndex:
+    """Membership index of the keys already stored in a results table.
+
+    A Bloom filter answers most lookups in memory; a hit is confirmed with
+    an exact primary-key query, so false positives never skip a request.
+    """
+
+    def __init__(self, table, key_columns, capacity, error_rate=0.001):
+        self.table = table
+        self.key_columns = key_columns
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.added = set()
+        self.lock = threading.Lock()
+
+        self.exists_sql = "SELECT 1 FROM `" + table + "` WHERE " + " AND ".join(
+            "`" + column + "`=%s" for column in key_columns) + " LIMIT 1"
+
+    @staticmethod
+    def encode(key):
+        return "\x1f".join(key)
+
+    def load(self):
+        print("Load fetched index:", self.table, datetime.now())
+
+        sql = "SELECT " + ", ".join(
+            "`" + column + "`"
+            for column in self.key_columns) + " FROM `" + self.table + "`"
+
+        count = 0
+        with get_mysql_pool().connection() as connection:
+            with connection.cursor(pymysql.cursors.SSCursor) as cursor:
+                cursor.execute(sql)
+                for row in cursor:
+                    self.bloom.add(self.encode(row))
+                    count += 1
+
+        print("Loaded", count, "keys", datetime.now())
+
+    def add(self, key):
+        encoded = self.encode(key)
+        with self.lock:
+            self.bloom.add(encoded)
+            self.added.add(encoded)
+
+    def contains(self, key):
+        encoded = self.encode(key)
+        with self.lock:
+            if encoded not in self.bloom:
+                return False
+            if encoded in self.added:
+                return True
+
+        with get_mysql_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(self.exists_sql, key)
+                return cursor.fetchone() is not None
+
+
+def estimate_rows(table):
+    with get_mysql_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT `TABLE_ROWS` FROM information_schema.`TABLES` WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = %s",
+                (table, ))
+            row = cursor.fetchone()
+
+    if row is None or row['TABLE_ROWS'] is None:
+        return 0
+
+    return int(row['TABLE_ROWS'])
+
+
+def get_fetched_index(table, key_columns):
+    with _fetched_indexes_lock:
+        fetched_index = _fetched_indexes.get(table)
+        if fetched_index is None:
+            # Leave room for the rows written during this run
+            capacity = max(1000000, estimate_rows(table) * 2)
+            fetched_index = FetchedIndex(table, key_columns, capacity)
+            fetched_index.load()
+            _fetched_indexes[table] = fetched_index
+
+    return fetched_index
+
+
+def find_fetched_index(table):
+    """Return the index of `table` if this process loaded one, else None."""
+    with _fetched_indexes_lock:
+        return _fetched_indexes.get(table)
@@ -0,0 +1,84 @@
+import queue
+import threading
+from datetime import datetime
+from time import sleep
+
+import pymysql
+
+from mysql_pool import get_mysql_pool
+
+
+def select_chunk(sql, args, attempts=5):
+    for attempt in range(attempts):
+        try:
+            with get_mysql_pool().connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(sql, args)
+                    return cursor.fetchall()
+        except (pymysql.OperationalError, pymysql.InterfaceError):
+            # The broken connection is dropped by the pool; read it again
+            if attempt == attempts - 1:
+                raise
+            print("Lost the database connection, retry...", datetime.now())
+            sleep(2**attempt)
+
+
+def iter_keyset_chunks(table, columns, chunk_size=500, id_start=0, id_end=0,
+                       where=None):
+    """Yield the rows of `table` in chunks ordered by `id`.
+
+    Every chunk is read with `WHERE id > last_id ORDER BY id LIMIT n` on a
+    freshly checked out connection, so memory stays bounded by one chunk and
+    no connection is held between chunks.  `where` is an extra SQL condition;
+    literal percent signs in it must be written as %%.
+    """
+    sql = "SELECT `id`, " + ", ".join(
+        "`" + column + "`"
+        for column in columns) + " FROM `" + table + "` WHERE `id` > %s"
+
+    if id_end > 0:
+        sql += " AND `id` <= " + str(int(id_end))
+
+    if where is not None:
+        sql += " AND (" + where + ")"
+
+    sql += " ORDER BY `id` LIMIT %s"
+
+    last_id = max(id_start, 1) - 1
+    while True:
+        rows = select_chunk(sql, (last_id, chunk_size))
+
+        if not rows:
+            return
+
+        yield rows
+
+        if len(rows) < chunk_size:
+            return
+
+        last_id = rows[-1]['id']
+
+
+def prefetch(iterable, depth=1):
+    """Iterate `iterable` in a background thread, up to `depth` items ahead."""
+    items = queue.Queue(maxsize=depth)
+    end = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put((item, None))
+        except BaseException as error:
+            items.put((None, error))
+        else:
+            items.put((end, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    while True:
+        item, error = items.get()
+        if error is not None:
+            raise error
+        if item is end:
+            return
+        yield item
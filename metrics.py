@@ -0,0 +1,237 @@
+import atexit
+import os
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics = None
+_metrics_lock = threading.Lock()
+_started = False
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """The upper bound of the bucket holding the q-quantile."""
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'), ), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+
+        return float('inf')
+
+
+class Metrics:
+    """Counters and latency histograms keyed by a name and labels.
+
+    render() returns them in the Prometheus text format; summary() is a
+    one line digest of the requests and DB writes since the last summary.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.last_summary = (monotonic(), {})
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self):
+        lines = []
+
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append("# TYPE " + name + " counter")
+                for (counter_name, labels), value in sorted(
+                        self.counters.items()):
+                    if counter_name == name:
+                        lines.append(name + format_labels(labels) + " " +
+                                     str(value))
+
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append("# TYPE " + name + " histogram")
+                for (histogram_name, labels), histogram in sorted(
+                        self.histograms.items(), key=lambda item: item[0]):
+                    if histogram_name != name:
+                        continue
+
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + ('+Inf', ),
+                                            histogram.counts):
+                        cumulative += count
+                        lines.append(name + "_bucket" + format_labels(
+                            labels + (('le', str(bound)), )) + " " +
+                                     str(cumulative))
+                    lines.append(name + "_sum" + format_labels(labels) + " " +
+                                 repr(histogram.sum))
+                    lines.append(name + "_count" + format_labels(labels) +
+                                 " " + str(histogram.count))
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        now = monotonic()
+
+        with self.lock:
+            last_time, last_counts = self.last_summary
+            elapsed = max(now - last_time, 1e-9)
+            counts = {}
+            parts = []
+
+            for (name, labels), histogram in sorted(
+                    self.histograms.items(), key=lambda item: item[0]):
+                if name != 'places_request_seconds':
+                    continue
+
+                endpoint = dict(labels)['endpoint']
+                counts[endpoint] = histogram.count
+                parts.append(
+                    endpoint + " " + str(histogram.count) + " (" +
+                    str(round((histogram.count - last_counts.get(endpoint, 0)) /
+                              elapsed, 1)) + "/s, p50<=" +
+                    str(histogram.quantile(0.5)) + "s, p99<=" +
+                    str(histogram.quantile(0.99)) + "s)")
+
+            statuses = {}
+            rows = 0
+            skipped = 0
+            for (name, labels), value in self.counters.items():
+                if name == 'places_requests_total':
+                    status = dict(labels)['status']
+                    statuses[status] = statuses.get(status, 0) + value
+                elif name == 'db_write_rows_total':
+                    rows += value
+                elif name == 'places_skipped_total':
+                    skipped += value
+
+            counts['db rows'] = rows
+            parts.append("status " + " ".join(
+                status + "=" + str(count)
+                for status, count in sorted(statuses.items())))
+            parts.append("skipped " + str(skipped))
+            parts.append("db rows " + str(rows) + " (" + str(
+                round((rows - last_counts.get('db rows', 0)) / elapsed, 1)) +
+                         "/s)")
+
+            self.last_summary = (now, counts)
+
+        return "Stats: " + "; ".join(parts)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join(
+        name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') +
+        '"' for name, value in labels) + "}"
+
+
+def get_metrics():
+    global _metrics
+
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+
+    return _metrics
+
+
+def mask_key(key):
+    return "..." + key[-4:] if key else ""
+
+
+def error_status(error):
+    """The API status of a googlemaps.exceptions.ApiError, else the type."""
+    return getattr(error, 'status', None) or type(error).__name__
+
+
+def record_request(endpoint, key, status, seconds):
+    metrics = get_metrics()
+    metrics.inc('places_requests_total', endpoint=endpoint, key=mask_key(key),
+                status=status)
+    metrics.observe('places_request_seconds', seconds, endpoint=endpoint)
+
+
+def record_skip(endpoint):
+    get_metrics().inc('places_skipped_total', endpoint=endpoint)
+
+
+def record_db_write(table, rows, seconds, failed=False):
+    metrics = get_metrics()
+    if failed:
+        metrics.inc('db_write_errors_total', table=table)
+        return
+
+    metrics.inc('db_writes_total', table=table)
+    metrics.inc('db_write_rows_total', rows, table=table)
+    metrics.observe('db_write_seconds', seconds, table=table)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = get_metrics().render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def print_summaries(interval):
+    while True:
+        sleep(interval)
+        print(get_metrics().summary(), datetime.now())
+
+
+def start_metrics():
+    """Serve /metrics on METRICS_PORT and print a summary line every
+    METRICS_SUMMARY_INTERVAL seconds, when they are set."""
+    global _started
+
+    with _metrics_lock:
+        if _started:
+            return
+        _started = True
+
+    port = int(os.environ.get("METRICS_PORT") or 0)
+    if port > 0:
+        server = ThreadingHTTPServer(('', port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    interval = float(os.environ.get("METRICS_SUMMARY_INTERVAL") or 0)
+    if interval > 0:
+        threading.Thread(
+            target=print_summaries, args=(interval, ), daemon=True).start()
+        atexit.register(lambda: print(get_metrics().summary(), datetime.now()))
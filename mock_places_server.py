@@ -0,0 +1,206 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import parse_qs, urlparse
+
+PHOTO_URL = "https://lh3.googleusercontent.com/p/"
+
+
+def digest(*parts):
+    return hashlib.sha1(":".join(parts).encode('utf-8')).hexdigest()
+
+
+def mock_place_id(*parts):
+    return "ChIJ" + digest("place", *parts)[:23]
+
+
+def mock_photo_reference(*parts):
+    return "CmRa" + digest("photo", *parts)
+
+
+class MockPlacesServer(ThreadingHTTPServer):
+    """A stand-in for the radarsearch, details and photo endpoints.
+
+    Every response is delayed by `latency` seconds (with a normally
+    distributed `jitter`).  A share of the requests fail with an HTTP 500
+    (`error_rate`) or an OVER_QUERY_LIMIT status (`over_query_limit_rate`).
+    Responses are derived from the request parameters, so they are the
+    same on every run.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.05, jitter=0.01, error_rate=0.0,
+                 over_query_limit_rate=0.0, max_results=200):
+        super().__init__(address, MockPlacesHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.over_query_limit_rate = over_query_limit_rate
+        self.max_results = max_results
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    def count_request(self):
+        with self.lock:
+            self.request_count += 1
+
+    def radar_search(self, params):
+        location = params.get('location', '')
+        place_type = params.get('type', '')
+        seed = int(digest(location, place_type)[:8], 16)
+        lat, lng = (float(value) for value in location.split(','))
+
+        results = [{
+            'geometry': {
+                'location': {
+                    'lat': lat + (seed % (index + 7)) * 1e-5,
+                    'lng': lng + (seed % (index + 11)) * 1e-5
+                }
+            },
+            'id': digest("id", location, place_type, str(index)),
+            'place_id': mock_place_id(location, place_type, str(index)),
+            'reference': digest("reference", location, place_type, str(index))
+        } for index in range(seed % (self.max_results + 1))]
+
+        status = 'OK' if results else 'ZERO_RESULTS'
+        return {'html_attributions': [], 'results': results, 'status': status}
+
+    def details(self, params):
+        place_id = params.get('placeid') or params.get('place_id', '')
+        seed = int(digest(place_id)[:8], 16)
+
+        return {
+            'html_attributions': [],
+            'result': {
+                'formatted_address': "Jl. Mock No. " + str(seed % 1000),
+                'geometry': {
+                    'location': {
+                        'lat': -6.2 + (seed % 1000) * 1e-4,
+                        'lng': 106.8 + (seed % 997) * 1e-4
+                    }
+                },
+                'name': "Mock Place " + place_id[-6:],
+                'photos': [{
+                    'height': 600,
+                    'html_attributions': [],
+                    'photo_reference': mock_photo_reference(
+                        place_id, str(index)),
+                    'width': 800
+                } for index in range(seed % 5)],
+                'place_id': place_id,
+                'rating': (seed % 50) / 10,
+                'types': ['establishment', 'point_of_interest'],
+                'url': "https://maps.google.com/?cid=" + str(seed)
+            },
+            'status': 'OK'
+        }
+
+
+class MockPlacesHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.count_request()
+
+        url = urlparse(self.path)
+        params = {
+            name: values[0]
+            for name, values in parse_qs(url.query).items()
+        }
+
+        sleep(max(0.0, random.gauss(server.latency, server.jitter)))
+
+        if random.random() < server.error_rate:
+            self.send_body(500, b"Internal Server Error", 'text/plain')
+            return
+
+        if not params.get('key'):
+            self.send_json({'error_message': "The provided API key is invalid.",
+                            'status': 'REQUEST_DENIED'})
+            return
+
+        if url.path == '/maps/api/place/photo':
+            self.send_response(302)
+            self.send_header(
+                'Location',
+                PHOTO_URL + digest(params.get('photoreference', '')) + "=s" +
+                params.get('maxwidth', '800'))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if random.random() < server.over_query_limit_rate:
+            self.send_json({'error_message': "You have exceeded your rate-limit for this API.",
+                            'html_attributions': [],
+                            'results': [],
+                            'status': 'OVER_QUERY_LIMIT'})
+            return
+
+        if url.path == '/maps/api/place/radarsearch/json':
+            self.send_json(server.radar_search(params))
+        elif url.path == '/maps/api/place/details/json':
+            self.send_json(server.details(params))
+        else:
+            self.send_body(404, b"Not Found", 'text/plain')
+
+    def send_json(self, response):
+        self.send_body(200, json.dumps(response).encode('utf-8'),
+                       'application/json; charset=UTF-8')
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host='127.0.0.1', port=0, **options):
+    """Serve in a daemon thread; port 0 picks a free port."""
+    server = MockPlacesServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', help='The address to listen on', default='127.0.0.1')
+    parser.add_argument('--port', help='The port to listen on', default='8000')
+    parser.add_argument(
+        '--latency', help='The mean response latency in ms', default='50')
+    parser.add_argument(
+        '--jitter', help='The standard deviation of the latency in ms', default='10')
+    parser.add_argument(
+        '--error-rate', help='The share of requests answered with HTTP 500', default='0')
+    parser.add_argument(
+        '--over-query-limit-rate',
+        help='The share of requests answered with OVER_QUERY_LIMIT',
+        default='0')
+    args = parser.parse_args()
+
+    server = MockPlacesServer(
+        (args.host, int(args.port)),
+        latency=float(args.latency) / 1000,
+        jitter=float(args.jitter) / 1000,
+        error_rate=float(args.error_rate),
+        over_query_limit_rate=float(args.over_query_limit_rate))
+
+    print("Mock Places API on http://" + args.host + ":" + args.port +
+          "; set GOOGLE_MAPS_BASE_URL to it and use keys starting with AIza")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import atexit
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from time import monotonic
+
+import pymysql.cursors
+
+_mysql_pool = None
+_mysql_pool_lock = threading.Lock()
+
+
+def get_mysql_connection():
+    MYSQL_HOST = os.environ.get("MYSQL_HOST")
+    MYSQL_USER = os.environ.get("MYSQL_USER")
+    MYSQL_PASSWORD = os.environ.get("MYSQL_PASSWORD")
+    MYSQL_DB = os.environ.get("MYSQL_DB")
+    MYSQL_CHARSET = os.environ.get("MYSQL_CHARSET")
+
+    connection = pymysql.connect(
+        host=MYSQL_HOST,
+        user=MYSQL_USER,
+        password=MYSQL_PASSWORD,
+        db=MYSQL_DB,
+        charset=MYSQL_CHARSET,
+        cursorclass=pymysql.cursors.DictCursor)
+
+    return connection
+
+
+class MySQLPool:
+    """A small thread-safe pool of persistent pymysql connections.
+
+    Idle connections are pinged (and reconnected) before reuse when they have
+    been idle longer than `ping_interval` seconds; a connection that breaks
+    while checked out is dropped instead of being returned to the pool.
+    """
+
+    def __init__(self, connect=get_mysql_connection, max_size=8,
+                 ping_interval=30):
+        self.connect = connect
+        self.ping_interval = ping_interval
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(max_size)
+
+    @contextmanager
+    def connection(self):
+        self.slots.acquire()
+        try:
+            connection = self.checkout()
+            try:
+                yield connection
+            except BaseException:
+                self.discard_or_release(connection)
+                raise
+            else:
+                self.release(connection)
+        finally:
+            self.slots.release()
+
+    def checkout(self):
+        try:
+            connection, released_at = self.idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+        if monotonic() - released_at < self.ping_interval:
+            return connection
+
+        try:
+            connection.ping(reconnect=True)
+        except pymysql.MySQLError:
+            self.close_quietly(connection)
+            return self.connect()
+
+        return connection
+
+    def release(self, connection):
+        self.idle.put((connection, monotonic()))
+
+    def discard_or_release(self, connection):
+        try:
+            connection.rollback()
+        except pymysql.MySQLError:
+            self.close_quietly(connection)
+        else:
+            self.release(connection)
+
+    def close_quietly(self, connection):
+        try:
+            connection.close()
+        except pymysql.MySQLError:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.close_quietly(connection)
+
+
+def get_mysql_pool():
+    global _mysql_pool
+
+    with _mysql_pool_lock:
+        if _mysql_pool is None:
+            max_size = int(os.environ.get("MYSQL_POOL_SIZE") or 8)
+            _mysql_pool = MySQLPool(max_size=max_size)
+            atexit.register(_mysql_pool.close)
+
+    return _mysql_pool
@@ -0,0 +1,137 @@
+import os
+from datetime import datetime
+
+from batch_writer import get_batch_writer
+from codec import extract_photo_references as find_photo_references
+from compression import decode_results
+from keyset import iter_keyset_chunks
+from mysql_pool import get_mysql_pool
+
+"""
+CREATE TABLE `place_photo_references` (
+  `id` bigint unsigned NOT NULL AUTO_INCREMENT,
+  `place_id` varchar(255) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `language` varchar(255) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `photo_reference` varchar(255) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `photo_reference` (`photo_reference`,`place_id`,`language`),
+  KEY `place_id` (`place_id`,`language`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+ALTER TABLE `place_photo_references`
+  ADD KEY `place_id` (`place_id`,`language`);
+"""
+
+
+def get_photo_references_table():
+    return os.environ.get(
+        "PLACE_PHOTO_REFERENCES_TABLE") or "place_photo_references"
+
+
+def insert_photo_references(place_id, language, place_details_result):
+    photos = place_details_result.get('result', {}).get('photos', [])
+    if not photos:
+        return
+
+    batch_writer = get_batch_writer(
+        get_photo_references_table(),
+        ('place_id', 'language', 'photo_reference'),
+        update_columns=('photo_reference', ))
+
+    for photo in photos:
+        batch_writer.add(place_id, language, photo['photo_reference'])
+
+
+def extract_photo_references(place_details_table, batch_size=1000):
+    """Backfill the side table from the stored place details with JSON_TABLE.
+
+    The details table is walked in primary key order, `batch_size` rows per
+    statement, so that no statement scans the whole table at once.
+    """
+    boundary_sql = "SELECT `place_id`, `language` FROM `" + place_details_table + "` WHERE (`place_id`, `language`) > (%s, %s) ORDER BY `place_id`, `language` LIMIT 1 OFFSET %s"
+    insert_sql = "INSERT IGNORE INTO `" + get_photo_references_table() + "` (`place_id`, `language`, `photo_reference`) SELECT `d`.`place_id`, `d`.`language`, `p`.`photo_reference` FROM `" + place_details_table + "` AS `d`, JSON_TABLE(`d`.`results`, '$.result.photos[*]' COLUMNS (`photo_reference` VARCHAR(255) PATH '$.photo_reference')) AS `p` WHERE (`d`.`place_id`, `d`.`language`) > (%s, %s)"
+
+    last_key = ('', '')
+    while True:
+        with get_mysql_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(boundary_sql, last_key + (batch_size - 1, ))
+                boundary = cursor.fetchone()
+
+                if boundary is None:
+                    cursor.execute(insert_sql, last_key)
+                else:
+                    cursor.execute(
+                        insert_sql +
+                        " AND (`d`.`place_id`, `d`.`language`) <= (%s, %s)",
+                        last_key + (boundary['place_id'], boundary['language']))
+            connection.commit()
+
+        if boundary is None:
+            return
+
+        last_key = (boundary['place_id'], boundary['language'])
+        print("Extracted photo references up to:", last_key, datetime.now())
+
+
+def extract_compressed_photo_references(place_details_table, batch_size=1000):
+    """Backfill the side table from compressed place details in Python.
+
+    JSON_TABLE can't read compressed rows, so they are decoded here.
+    """
+    sql = "SELECT `place_id`, `language`, `results_compressed` FROM `" + place_details_table + "` WHERE `results_compressed` IS NOT NULL AND (`place_id`, `language`) > (%s, %s) ORDER BY `place_id`, `language` LIMIT %s"
+    batch_writer = get_batch_writer(
+        get_photo_references_table(),
+        ('place_id', 'language', 'photo_reference'),
+        update_columns=('photo_reference', ))
+
+    last_key = ('', '')
+    while True:
+        with get_mysql_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, last_key + (batch_size, ))
+                rows = cursor.fetchall()
+
+        for row in rows:
+            payload = decode_results(row)
+            for photo_reference in find_photo_references(payload):
+                batch_writer.add(row['place_id'], row['language'],
+                                 photo_reference)
+
+        if len(rows) < batch_size:
+            batch_writer.flush()
+            return
+
+        last_key = (rows[-1]['place_id'], rows[-1]['language'])
+        print("Extracted photo references up to:", last_key, datetime.now())
+
+
+def select_photo_references(place_id, language):
+    with get_mysql_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            sql = "SELECT `photo_reference` FROM `" + get_photo_references_table() + "` WHERE `place_id`=%s AND `language`=%s"
+            cursor.execute(sql, (place_id, language))
+            return [row['photo_reference'] for row in cursor.fetchall()]
+
+
+def select_max_id():
+    with get_mysql_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            sql = "SELECT MAX(`id`) AS `max_id` FROM `" + get_photo_references_table() + "`"
+            cursor.execute(sql)
+            max_id = cursor.fetchone()['max_id']
+
+    return max_id or 0
+
+
+def iter_photo_references(id_start=0, id_end=0, chunk_size=1000):
+    chunks = iter_keyset_chunks(
+        get_photo_references_table(), ('photo_reference', ),
+        chunk_size=chunk_size,
+        id_start=id_start,
+        id_end=id_end)
+
+    for rows in chunks:
+        for row in rows:
+            yield row['photo_reference']
@@ -0,0 +1,246 @@
+import argparse
+import logging
+import os
+import queue
+import sys
+import threading
+from datetime import datetime
+from os.path import dirname, join
+
+from dotenv import load_dotenv
+
+import place_details
+import place_photo
+import radar_search
+from batch_writer import flush_all
+from concurrency import run_bounded
+from coverage import circles_intersect, hex_centers, load_polygons
+from metrics import record_skip, start_metrics
+from photo_references import select_photo_references
+from place_fields import parse_fields
+from rate_limiter import QuotaExhaustedError
+
+dotenv_path = join(dirname(__file__), '.env')
+load_dotenv(dotenv_path, override=True)
+
+
+class Stage:
+    """Worker threads taking items from a bounded queue.
+
+    put() blocks while the queue is full, so a slow stage holds back the
+    stage feeding it instead of buffering without limit.  Once the daily
+    quota of every key is exhausted the rest of the queue is drained
+    without being processed and the error is kept in `error`.
+    """
+
+    def __init__(self, name, func, concurrency, queue_size):
+        self.name = name
+        self.func = func
+        self.items = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.error = None
+        self.lock = threading.Lock()
+        self.workers = [
+            threading.Thread(target=self.work, daemon=True)
+            for _ in range(concurrency)
+        ]
+
+        for worker in self.workers:
+            worker.start()
+
+    def put(self, item):
+        self.items.put(item)
+
+    def work(self):
+        while True:
+            item = self.items.get()
+            if item is None:
+                return
+
+            if self.error is not None:
+                continue
+
+            try:
+                self.func(item)
+            except QuotaExhaustedError as error:
+                self.error = error
+                continue
+            except Exception as error:
+                print("Unexpected error in", self.name, "stage:", repr(error),
+                      file=sys.stderr)
+
+            with self.lock:
+                self.processed += 1
+
+    def close(self):
+        """Wait for the queued items to be processed and stop the workers."""
+        for _ in self.workers:
+            self.items.put(None)
+
+        for worker in self.workers:
+            worker.join()
+
+        print("==", self.name, "stage done:", self.processed, "items",
+              datetime.now(), "==")
+
+
+class Pipeline:
+    """radar search -> place details -> place photos, overlapped.
+
+    Place IDs go to the details stage as soon as their radar search
+    returns, and photo references go to the photo stage as soon as their
+    place details do.
+    """
+
+    def __init__(self, language, details_concurrency, photos_concurrency,
+                 queue_size):
+        self.language = language
+        self.seen_place_ids = set()
+        self.seen_photo_references = set()
+        self.lock = threading.Lock()
+        self.photos = Stage('photos', place_photo.request_place_photo,
+                            photos_concurrency, queue_size)
+        self.details = Stage('details', self.request_details,
+                             details_concurrency, queue_size)
+
+    def first_seen(self, seen, item):
+        # Overlapping search circles return the same places again
+        with self.lock:
+            if item in seen:
+                return False
+            seen.add(item)
+            return True
+
+    def search(self, cell):
+        lat, lng, radius = cell
+        results = radar_search.radar_search(lat, lng, radius)
+
+        for places_radar_result in results.values():
+            if type(places_radar_result) is not dict:
+                continue
+
+            for result in places_radar_result.get('results', []):
+                place_id = result['place_id']
+                if self.first_seen(self.seen_place_ids, place_id):
+                    self.details.put(place_id)
+
+    def request_details(self, place_id):
+        if (not place_details.force and
+                place_details.get_place_details_index().contains(
+                    (place_id, self.language))):
+            # Stored by an earlier run, whose photos may not all be fetched;
+            # the photo index skips the ones that are
+            record_skip('details')
+            photo_references = select_photo_references(place_id,
+                                                       self.language)
+        else:
+            place_details_result = place_details.request_place_details(
+                place_id, self.language)
+            if place_details_result is None:
+                return
+
+            photo_references = [
+                photo['photo_reference'] for photo in place_details_result.get(
+                    'result', {}).get('photos', [])
+            ]
+
+        for photo_reference in photo_references:
+            if self.first_seen(self.seen_photo_references, photo_reference):
+                self.photos.put(photo_reference)
+
+    def run(self, cells, radar_concurrency):
+        try:
+            run_bounded(self.search, cells, radar_concurrency)
+        finally:
+            self.details.close()
+            self.photos.close()
+            flush_all()
+
+        for stage in (self.details, self.photos):
+            if stage.error is not None:
+                raise stage.error
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--lat1',
+        help='The starting point of latitude measurement',
+        default='-6.3425357')
+    parser.add_argument(
+        '--lng1',
+        help='The starting point of longitude measurement',
+        default='106.6790033')
+    parser.add_argument(
+        '--lat2',
+        help='The end point of latitude measurement',
+        default='-6.0130311')
+    parser.add_argument(
+        '--lng2',
+        help='The end point of longitude measurement',
+        default='107.005707')
+    parser.add_argument('-r', help='radius', default='125')
+    parser.add_argument(
+        '--polygon',
+        help='A GeoJSON (Multi)Polygon file; circles outside it are skipped',
+        default=None)
+    parser.add_argument(
+        '--radar-concurrency',
+        help='The number of radar searches kept in flight',
+        default='2')
+    parser.add_argument(
+        '--details-concurrency',
+        help='The number of place details requests kept in flight',
+        default='8')
+    parser.add_argument(
+        '--photos-concurrency',
+        help='The number of photo requests kept in flight',
+        default='8')
+    parser.add_argument(
+        '--queue-size',
+        help='The number of items buffered in front of a stage',
+        default='1000')
+    parser.add_argument(
+        '--force',
+        help='Request again even if the result is already stored',
+        action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL") or "INFO",
+        format="%(asctime)s %(levelname)s %(message)s")
+    start_metrics()
+
+    place_details.fields = parse_fields(place_details.PLACE_DETAILS_FIELDS)
+    place_details.force = place_photo.force = args.force
+    if not args.force:
+        place_details.get_place_details_index()
+        place_photo.get_place_photos_index()
+
+    radius = int(args.r)
+    center_lats, center_lngs = hex_centers(
+        min(float(args.lat1), float(args.lat2)),
+        min(float(args.lng1), float(args.lng2)),
+        max(float(args.lat1), float(args.lat2)),
+        max(float(args.lng1), float(args.lng2)), radius)
+
+    if args.polygon is not None:
+        mask = circles_intersect(center_lats, center_lngs, radius,
+                                 load_polygons(args.polygon))
+        center_lats = center_lats[mask]
+        center_lngs = center_lngs[mask]
+
+    print("Circles:", len(center_lats), "Radar requests:",
+          len(center_lats) * len(radar_search.PLACE_TYPES))
+
+    cells = ((lat, lng, radius)
+             for lat, lng in zip(center_lats.tolist(), center_lngs.tolist()))
+
+    pipeline = Pipeline(place_details.PLACE_DETAILS_LANG,
+                        int(args.details_concurrency),
+                        int(args.photos_concurrency), int(args.queue_size))
+    pipeline.run(cells, int(args.radar_concurrency))
+
+
+if __name__ == "__main__":
+    main()
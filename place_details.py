@@ -1,30 +1,41 @@
 import argparse
-import json
+import logging
 import os
-import random
-import sys
-from datetime import datetime
 from os.path import dirname, join
-from time import sleep
 
-import googlemaps
 from dotenv import load_dotenv
 
-import pymysql.cursors
+from batch_writer import get_batch_writer
+from client_pool import get_client_pool
+from codec import dumps, extract_place_ids
+from concurrency import run_bounded
+from dedup import iter_unique
+from fetched_index import get_fetched_index
+from keyset import iter_keyset_chunks
+from metrics import record_skip, start_metrics
+from mysql_pool import get_mysql_pool
+from place_details_store import store_place_details
+from place_fields import parse_fields, request_fields
+from response_cache import cached_response
+from retry import request_with_retries
+from work_lease import iter_leased_ranges
 
 dotenv_path = join(dirname(__file__), '.env')
 load_dotenv(dotenv_path, override=True)
 
-GOOGLE_PLACES_API_KEYS = os.environ.get("GOOGLE_PLACES_API_KEYS").split(",")
+logger = logging.getLogger(__name__)
+
 RADAR_SEARCHS_TABLE = os.environ.get("RADAR_SEARCHS_TABLE")
 PLACE_DETAILS_LANG = os.environ.get("PLACE_DETAILS_LANG")
 PLACE_DETAILS_TABLE = os.environ.get("PLACE_DETAILS_TABLE")
+PLACE_DETAILS_FIELDS = os.environ.get("PLACE_DETAILS_FIELDS")
 PLACE_DETAILS_FAILED_TABLE = os.environ.get("PLACE_DETAILS_FAILED_TABLE")
 """
 CREATE TABLE `place_details` (
   `place_id` varchar(255) COLLATE utf8mb4_unicode_ci NOT NULL DEFAULT '',
   `language` varchar(255) COLLATE utf8mb4_unicode_ci NOT NULL,
   `results` json DEFAULT NULL,
+  `results_compressed` mediumblob DEFAULT NULL,
   `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `updated_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
   PRIMARY KEY (`place_id`,`language`),
@@ -33,147 +44,104 @@ CREATE TABLE `place_details` (
 """
 
 
-def get_gmaps():
-    gmaps = googlemaps.Client(key=random.choice(GOOGLE_PLACES_API_KEYS))
-    return gmaps
+force = False
+fields = None
+
+
+def get_place_details_index():
+    return get_fetched_index(PLACE_DETAILS_TABLE, ('place_id', 'language'))
 
 
 def request_place_details(place_id, language):
+    """Fetch and store the details of a place; returns them when stored."""
+    if not force and get_place_details_index().contains((place_id, language)):
+        logger.debug("Already fetched: %s %s", place_id, language)
+        record_skip('details')
+        return
+
     place_details_result = get_place_details_result(place_id, language)
+    if place_details_result is None:
+        return
 
+    # The request was already retried within the item's retry budget
     if type(place_details_result) is dict:
-        # If the query fails
-        if place_details_result['status'] != 'OK' and place_details_result['status'] != 'ZERO_RESULTS':
-            # retry
-            place_details_result = get_place_details_result(place_id, language)
-
-        # If it still fails
-        if place_details_result['status'] != 'OK' and place_details_result['status'] != 'ZERO_RESULTS':
-            insert_place_details_result_failed(place_id, language,
-                                               place_details_result)
-        else:
-            insert_place_details_result(place_id, language,
-                                        place_details_result)
+        insert_place_details_result(place_id, language, place_details_result)
+        return place_details_result
     else:
-        print("Failed.")
+        print("Failed:", place_id, language)
         insert_place_details_result_failed(place_id, language,
                                            place_details_result)
 
 
 def get_place_details_result(place_id, language):
-    place_details_result = None
-
-    for attempt in range(10):
-        sleep(0.05)
-        gmaps = get_gmaps()
-
-        print("Get place details result:", place_id, datetime.now())
-
-        try:
-            # raise googlemaps.exceptions.TransportError()
-            place_details_result = gmaps.place(place_id, language=language)
-        except:
-            print("Unexpected error:", sys.exc_info())
-            place_details_result = "Unexpected error:" + str(sys.exc_info())
-            print("Sleep a second...")
-            sleep(1)
-        else:
-            print("Got it.")
-            break
-
-    return place_details_result
+    params = {'place_id': place_id, 'language': language, 'fields': fields}
+    return cached_response(
+        'details', params,
+        lambda: fetch_place_details_result(place_id, language))
 
 
-def get_mysql_connection():
-    MYSQL_HOST = os.environ.get("MYSQL_HOST")
-    MYSQL_USER = os.environ.get("MYSQL_USER")
-    MYSQL_PASSWORD = os.environ.get("MYSQL_PASSWORD")
-    MYSQL_DB = os.environ.get("MYSQL_DB")
-    MYSQL_CHARSET = os.environ.get("MYSQL_CHARSET")
+def fetch_place_details_result(place_id, language):
+    logger.debug("Get place details result: %s", place_id)
+    kwargs = {'language': language}
+    if fields:
+        kwargs['fields'] = request_fields(fields)
 
-    connection = pymysql.connect(
-        host=MYSQL_HOST,
-        user=MYSQL_USER,
-        password=MYSQL_PASSWORD,
-        db=MYSQL_DB,
-        charset=MYSQL_CHARSET,
-        cursorclass=pymysql.cursors.DictCursor)
-
-    return connection
+    place_details_result, success = request_with_retries(
+        'details',
+        lambda key: get_client_pool().get_gmaps(key).place(place_id, **kwargs))
+    return place_details_result
 
 
-def select_all(id_start, id_end):
-    connection = get_mysql_connection()
-    try:
+def select_max_id():
+    with get_mysql_pool().connection() as connection:
         with connection.cursor() as cursor:
-            sql = "SELECT `id` FROM " + RADAR_SEARCHS_TABLE + " WHERE `results` NOT LIKE '%ZERO_RESULTS%'"
-
-            if id_start > 0:
-                sql += " AND `id` >= " + str(id_start)
-
-            if id_end > 0:
-                sql += " AND `id` <= " + str(id_end)
-
+            sql = "SELECT MAX(`id`) AS `max_id` FROM " + RADAR_SEARCHS_TABLE
             cursor.execute(sql)
-            radar_searchs_ids = cursor.fetchall()
-    finally:
-        connection.close()
-
-    return radar_searchs_ids
+            max_id = cursor.fetchone()['max_id']
 
+    return max_id or 0
 
-def select_radar_searchs_result(id):
-    print("=== Radar Search ID:", id, "===")
 
-    connection = get_mysql_connection()
+def get_place_id_list(json_results):
+    return extract_place_ids(json_results['results'])
 
-    try:
-        with connection.cursor() as cursor:
-            sql = "SELECT `results` FROM " + RADAR_SEARCHS_TABLE + " WHERE `id`=%s"
-            cursor.execute(sql, (id, ))
-            json_results = cursor.fetchone()
-    finally:
-        connection.close()
 
-    return json_results
+def insert_place_details_result(place_id, language, place_details_result):
+    store_place_details(PLACE_DETAILS_TABLE, place_id, language,
+                        place_details_result, fields)
 
 
-def get_place_id_list(json_results):
-    results_row_data = json.loads(json_results['results'])['results']
+def insert_place_details_result_failed(place_id, language,
+                                       place_details_result):
+    batch_writer = get_batch_writer(
+        PLACE_DETAILS_FAILED_TABLE, ('place_id', 'language', 'results'),
+        update_columns=('results', ))
+    batch_writer.add(place_id, language, dumps(place_details_result))
 
-    place_ids = []
-    for place in results_row_data:
-        place_ids.append(place['place_id'])
 
-    return place_ids
+def iter_place_ids(id_start, id_end):
+    chunks = iter_keyset_chunks(
+        RADAR_SEARCHS_TABLE, ('results', ),
+        chunk_size=200,
+        id_start=id_start,
+        id_end=id_end,
+        where="`results` NOT LIKE '%%ZERO_RESULTS%%'")
 
+    for rows in chunks:
+        for json_results in rows:
+            logger.debug("Radar search ID: %s", json_results['id'])
 
-def insert_place_details_result(place_id, language, place_details_result):
-    connection = get_mysql_connection()
-    try:
-        with connection.cursor() as cursor:
-            # Create a new record
-            sql = "INSERT INTO `" + PLACE_DETAILS_TABLE + "` (`place_id`, `language`, `results`) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE `results` = %s;"
-            cursor.execute(
-                sql, (place_id, language, json.dumps(place_details_result),
-                      json.dumps(place_details_result)))
-        connection.commit()
-    finally:
-        connection.close()
+            for place_id in get_place_id_list(json_results):
+                yield place_id
 
 
-def insert_place_details_result_failed(place_id, language,
-                                       place_details_result):
-    connection = get_mysql_connection()
-    try:
-        with connection.cursor() as cursor:
-            sql = "INSERT INTO `" + PLACE_DETAILS_FAILED_TABLE + "` (`place_id`, `language`, `results`) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE `results` = %s;"
-            cursor.execute(
-                sql, (place_id, language, json.dumps(place_details_result),
-                      json.dumps(place_details_result)))
-        connection.commit()
-    finally:
-        connection.close()
+def request_radar_searchs(id_start, id_end, concurrency=1,
+                          max_in_memory=1000000):
+    # Overlapping cells and place types return the same places many times
+    place_ids = iter_unique(iter_place_ids(id_start, id_end), max_in_memory)
+    run_bounded(
+        lambda place_id: request_place_details(place_id, PLACE_DETAILS_LANG),
+        place_ids, concurrency)
 
 
 def main():
@@ -181,19 +149,57 @@ def main():
     parser.add_argument(
         '-s', help='The starting ID of radar_searchs', default='0')
     parser.add_argument('-e', help='The end ID of radar_searchs', default='0')
+    parser.add_argument(
+        '-c',
+        help='The number of place details requests kept in flight',
+        default='1')
+    parser.add_argument(
+        '--dedup-memory',
+        help='The number of unique place_ids kept in memory before sorting them on disk',
+        default='1000000')
+    parser.add_argument(
+        '--fields',
+        help='A comma separated Place Details field mask, e.g. name,geometry/location,photo',
+        default=PLACE_DETAILS_FIELDS)
+    parser.add_argument(
+        '--force',
+        help='Request again even if the result is already stored',
+        action='store_true')
+    parser.add_argument(
+        '--lease',
+        help='A job name; radar_searchs ids are claimed in chunks shared with other nodes',
+        default=None)
+    parser.add_argument(
+        '--chunk', help='The number of radar_searchs ids in a leased chunk', default='1000')
     args = parser.parse_args()
 
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL") or "INFO",
+        format="%(asctime)s %(levelname)s %(message)s")
+    start_metrics()
+
+    global fields, force
+    fields = parse_fields(args.fields)
+    force = args.force
+    if not force:
+        get_place_details_index()
+
     id_start = int(args.s)
     id_end = int(args.e)
+    concurrency = int(args.c)
+    max_in_memory = int(args.dedup_memory)
 
-    radar_searchs_ids = select_all(id_start, id_end)
+    if args.lease is None:
+        request_radar_searchs(id_start, id_end, concurrency, max_in_memory)
+        return
 
-    for radar_searchs_id in radar_searchs_ids:
-        json_results = select_radar_searchs_result(radar_searchs_id['id'])
+    if id_end <= 0:
+        id_end = select_max_id()
 
-        place_ids = get_place_id_list(json_results)
-        for place_id in place_ids:
-            request_place_details(place_id, PLACE_DETAILS_LANG)
+    for chunk_start, chunk_end in iter_leased_ranges(
+            args.lease, max(id_start, 1), id_end, int(args.chunk)):
+        request_radar_searchs(chunk_start, chunk_end, concurrency,
+                              max_in_memory)
 
 
 if __name__ == "__main__":
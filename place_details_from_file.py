@@ -1,129 +1,153 @@
-import json
+import argparse
+import logging
 import os
-import random
-import sys
+from itertools import islice
 from datetime import datetime
 from os.path import dirname, join
-from time import sleep
 
-import googlemaps
 from dotenv import load_dotenv
 
-import pymysql.cursors
+from batch_writer import get_batch_writer
+from client_pool import get_client_pool
+from codec import dumps
+from concurrency import run_bounded
+from fetched_index import get_fetched_index
+from metrics import record_skip, start_metrics
+from place_details_store import store_place_details
+from place_fields import parse_fields, request_fields
+from response_cache import cached_response
+from retry import request_with_retries
+from work_lease import iter_leased_ranges
 
 dotenv_path = join(dirname(__file__), '.env')
 load_dotenv(dotenv_path, override=True)
 
-GOOGLE_PLACES_API_KEYS = os.environ.get("GOOGLE_PLACES_API_KEYS").split(",")
+logger = logging.getLogger(__name__)
+
 PLACE_DETAILS_LANG = os.environ.get("PLACE_DETAILS_LANG")
 PLACE_DETAILS_TABLE = os.environ.get("PLACE_DETAILS_TABLE")
+PLACE_DETAILS_FIELDS = os.environ.get("PLACE_DETAILS_FIELDS")
 PLACE_DETAILS_FAILED_TABLE = os.environ.get("PLACE_DETAILS_FAILED_TABLE")
 PLACE_DETAILS_FILE = os.environ.get("PLACE_DETAILS_FILE")
 
 
-def get_gmaps():
-    gmaps = googlemaps.Client(key=random.choice(GOOGLE_PLACES_API_KEYS))
-    return gmaps
+force = False
+fields = None
+
+
+def get_place_details_index():
+    return get_fetched_index(PLACE_DETAILS_TABLE, ('place_id', 'language'))
 
 
 def request_place_details(place_id, language):
+    if not force and get_place_details_index().contains((place_id, language)):
+        logger.debug("Already fetched: %s %s", place_id, language)
+        record_skip('details')
+        return
+
     place_details_result = get_place_details_result(place_id, language)
+    if place_details_result is None:
+        return
 
+    # The request was already retried within the item's retry budget
     if type(place_details_result) is dict:
-        # If the query fails
-        if place_details_result['status'] != 'OK' and place_details_result['status'] != 'ZERO_RESULTS':
-            # retry
-            place_details_result = get_place_details_result(place_id, language)
-
-        # If it still fails
-        if place_details_result['status'] != 'OK' and place_details_result['status'] != 'ZERO_RESULTS':
-            insert_place_details_result_failed(place_id, language,
-                                               place_details_result)
-        else:
-            insert_place_details_result(place_id, language,
-                                        place_details_result)
+        insert_place_details_result(place_id, language, place_details_result)
     else:
-        print("Failed.")
+        print("Failed:", place_id, language)
         insert_place_details_result_failed(place_id, language,
                                            place_details_result)
 
 
 def get_place_details_result(place_id, language):
-    place_details_result = None
-
-    for attempt in range(5):
-        sleep(0.05)
-        gmaps = get_gmaps()
-
-        print("Get place details result:", place_id, datetime.now())
-
-        try:
-            # raise googlemaps.exceptions.TransportError()
-            place_details_result = gmaps.place(place_id, language=language)
-        except:
-            print("Unexpected error:", sys.exc_info()[0])
-            place_details_result = "Unexpected error:" + str(sys.exc_info()[0])
-            print("Sleep 10 seconds...")
-            sleep(10)
-        else:
-            print("Got it.")
-            break
-
-    return place_details_result
-
+    params = {'place_id': place_id, 'language': language, 'fields': fields}
+    return cached_response(
+        'details', params,
+        lambda: fetch_place_details_result(place_id, language))
 
-def get_mysql_connection():
-    MYSQL_HOST = os.environ.get("MYSQL_HOST")
-    MYSQL_USER = os.environ.get("MYSQL_USER")
-    MYSQL_PASSWORD = os.environ.get("MYSQL_PASSWORD")
-    MYSQL_DB = os.environ.get("MYSQL_DB")
-    MYSQL_CHARSET = os.environ.get("MYSQL_CHARSET")
 
-    connection = pymysql.connect(
-        host=MYSQL_HOST,
-        user=MYSQL_USER,
-        password=MYSQL_PASSWORD,
-        db=MYSQL_DB,
-        charset=MYSQL_CHARSET,
-        cursorclass=pymysql.cursors.DictCursor)
+def fetch_place_details_result(place_id, language):
+    logger.debug("Get place details result: %s", place_id)
+    kwargs = {'language': language}
+    if fields:
+        kwargs['fields'] = request_fields(fields)
 
-    return connection
+    place_details_result, success = request_with_retries(
+        'details',
+        lambda key: get_client_pool().get_gmaps(key).place(place_id, **kwargs))
+    return place_details_result
 
 
 def insert_place_details_result(place_id, language, place_details_result):
-    connection = get_mysql_connection()
-    try:
-        with connection.cursor() as cursor:
-            # Create a new record
-            sql = "INSERT INTO `" + PLACE_DETAILS_TABLE + "` (`place_id`, `language`, `results`, `created_at`, `updated_at`) VALUES (%s, %s, %s, %s, %s)"
-            cursor.execute(
-                sql, (place_id, language, json.dumps(place_details_result),
-                      datetime.now(), datetime.now()))
-        connection.commit()
-    finally:
-        connection.close()
+    store_place_details(PLACE_DETAILS_TABLE, place_id, language,
+                        place_details_result, fields)
 
 
 def insert_place_details_result_failed(place_id, language,
                                        place_details_result):
-    connection = get_mysql_connection()
-    try:
-        with connection.cursor() as cursor:
-            # Create a new record
-            sql = "INSERT INTO `" + PLACE_DETAILS_FAILED_TABLE + "` (`place_id`, `language`, `results`, `created_at`, `updated_at`) VALUES (%s, %s, %s, %s, %s)"
-            cursor.execute(
-                sql, (place_id, language, json.dumps(place_details_result),
-                      datetime.now(), datetime.now()))
-        connection.commit()
-    finally:
-        connection.close()
+    batch_writer = get_batch_writer(
+        PLACE_DETAILS_FAILED_TABLE,
+        ('place_id', 'language', 'results', 'created_at', 'updated_at'),
+        update_columns=('results', 'updated_at'))
+    batch_writer.add(place_id, language, dumps(place_details_result),
+                     datetime.now(), datetime.now())
+
+
+def request_lines(line_start, line_end, concurrency):
+    stop = None if line_end is None else line_end + 1
+
+    with open(PLACE_DETAILS_FILE) as input_file:
+        place_ids = (line.strip()
+                     for line in islice(input_file, line_start, stop))
+        run_bounded(
+            lambda place_id: request_place_details(place_id, PLACE_DETAILS_LANG),
+            place_ids, concurrency)
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-c',
+        help='The number of place details requests kept in flight',
+        default='1')
+    parser.add_argument(
+        '--fields',
+        help='A comma separated Place Details field mask, e.g. name,geometry/location,photo',
+        default=PLACE_DETAILS_FIELDS)
+    parser.add_argument(
+        '--force',
+        help='Request again even if the result is already stored',
+        action='store_true')
+    parser.add_argument(
+        '--lease',
+        help='A job name; lines are claimed in chunks shared with other nodes',
+        default=None)
+    parser.add_argument(
+        '--chunk', help='The number of lines in a leased chunk', default='1000')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL") or "INFO",
+        format="%(asctime)s %(levelname)s %(message)s")
+    start_metrics()
+
+    global fields, force
+    fields = parse_fields(args.fields)
+    force = args.force
+    if not force:
+        get_place_details_index()
+
+    concurrency = int(args.c)
+
+    if args.lease is None:
+        request_lines(0, None, concurrency)
+        return
+
     with open(PLACE_DETAILS_FILE) as input_file:
-        for line in input_file:
-            place_id = line.strip()
-            request_place_details(place_id, PLACE_DETAILS_LANG)
+        line_count = sum(1 for line in input_file)
+
+    for chunk_start, chunk_end in iter_leased_ranges(
+            args.lease, 0, line_count - 1, int(args.chunk)):
+        request_lines(chunk_start, chunk_end, concurrency)
 
 
 if __name__ == "__main__":
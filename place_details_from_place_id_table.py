@@ -1,29 +1,39 @@
 import argparse
-import json
+import logging
 import os
-import random
-import sys
-from datetime import datetime
 from os.path import dirname, join
-from time import sleep
 
-import googlemaps
-import pymysql.cursors
+from batch_writer import get_batch_writer
+from client_pool import get_client_pool
+from codec import dumps, extract_place_ids
+from concurrency import run_bounded
 from dotenv import load_dotenv
+from fetched_index import get_fetched_index
+from keyset import iter_keyset_chunks, prefetch
+from metrics import record_skip, start_metrics
+from mysql_pool import get_mysql_pool
+from place_details_store import store_place_details
+from place_fields import parse_fields, request_fields
+from response_cache import cached_response
+from retry import request_with_retries
+from work_lease import iter_leased_ranges
 
 dotenv_path = join(dirname(__file__), '.env')
 load_dotenv(dotenv_path, override=True)
 
-GOOGLE_PLACES_API_KEYS = os.environ.get("GOOGLE_PLACES_API_KEYS").split(",")
+logger = logging.getLogger(__name__)
+
 PLACE_IDS_TABLE = os.environ.get("PLACE_IDS_TABLE")
 PLACE_DETAILS_LANG = os.environ.get("PLACE_DETAILS_LANG")
 PLACE_DETAILS_TABLE = os.environ.get("PLACE_DETAILS_TABLE")
+PLACE_DETAILS_FIELDS = os.environ.get("PLACE_DETAILS_FIELDS")
 PLACE_DETAILS_FAILED_TABLE = os.environ.get("PLACE_DETAILS_FAILED_TABLE")
 """
 CREATE TABLE `place_details` (
   `place_id` varchar(255) COLLATE utf8mb4_unicode_ci NOT NULL DEFAULT '',
   `language` varchar(255) COLLATE utf8mb4_unicode_ci NOT NULL,
   `results` json DEFAULT NULL,
+  `results_compressed` mediumblob DEFAULT NULL,
   `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `updated_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
   PRIMARY KEY (`place_id`,`language`),
@@ -32,127 +42,113 @@ CREATE TABLE `place_details` (
 """
 
 
-def get_gmaps():
-    gmaps = googlemaps.Client(key=random.choice(GOOGLE_PLACES_API_KEYS))
-    return gmaps
+force = False
+fields = None
+
+
+def get_place_details_index():
+    return get_fetched_index(PLACE_DETAILS_TABLE, ('place_id', 'language'))
 
 
 def request_place_details(place_id, language):
+    if not force and get_place_details_index().contains((place_id, language)):
+        logger.debug("Already fetched: %s %s", place_id, language)
+        record_skip('details')
+        return
+
     place_details_result = get_place_details_result(place_id, language)
+    if place_details_result is None:
+        return
 
+    # The request was already retried within the item's retry budget
     if type(place_details_result) is dict:
-        # If the query fails
-        if place_details_result['status'] != 'OK' and place_details_result['status'] != 'ZERO_RESULTS':
-            # retry
-            place_details_result = get_place_details_result(place_id, language)
-
-        # If it still fails
-        if place_details_result['status'] != 'OK' and place_details_result['status'] != 'ZERO_RESULTS':
-            insert_place_details_result_failed(place_id, language,
-                                               place_details_result)
-        else:
-            insert_place_details_result(place_id, language,
-                                        place_details_result)
+        insert_place_details_result(place_id, language, place_details_result)
     else:
-        print("Failed.")
+        print("Failed:", place_id, language)
         insert_place_details_result_failed(place_id, language,
                                            place_details_result)
 
 
 def get_place_details_result(place_id, language):
-    place_details_result = None
-
-    for attempt in range(10):
-        sleep(0.05)
-        gmaps = get_gmaps()
-
-        print("Get place details result:", place_id, datetime.now())
-
-        try:
-            # raise googlemaps.exceptions.TransportError()
-            place_details_result = gmaps.place(place_id, language=language)
-        except:
-            print("Unexpected error:", sys.exc_info())
-            place_details_result = "Unexpected error:" + str(sys.exc_info())
-            print("Sleep a second...")
-            sleep(1)
-        else:
-            print("Got it.")
-            break
+    params = {'place_id': place_id, 'language': language, 'fields': fields}
+    return cached_response(
+        'details', params,
+        lambda: fetch_place_details_result(place_id, language))
 
-    return place_details_result
 
+def fetch_place_details_result(place_id, language):
+    logger.debug("Get place details result: %s", place_id)
+    kwargs = {'language': language}
+    if fields:
+        kwargs['fields'] = request_fields(fields)
 
-def get_mysql_connection():
-    MYSQL_HOST = os.environ.get("MYSQL_HOST")
-    MYSQL_USER = os.environ.get("MYSQL_USER")
-    MYSQL_PASSWORD = os.environ.get("MYSQL_PASSWORD")
-    MYSQL_DB = os.environ.get("MYSQL_DB")
-    MYSQL_CHARSET = os.environ.get("MYSQL_CHARSET")
-
-    connection = pymysql.connect(
-        host=MYSQL_HOST,
-        user=MYSQL_USER,
-        password=MYSQL_PASSWORD,
-        db=MYSQL_DB,
-        charset=MYSQL_CHARSET,
-        cursorclass=pymysql.cursors.DictCursor)
-
-    return connection
+    place_details_result, success = request_with_retries(
+        'details',
+        lambda key: get_client_pool().get_gmaps(key).place(place_id, **kwargs))
+    return place_details_result
 
 
 def select_radar_searchs_result(id):
-    print("=== Radar Search ID:", id, "===")
-
-    connection = get_mysql_connection()
+    logger.debug("Radar search ID: %s", id)
 
-    try:
+    with get_mysql_pool().connection() as connection:
         with connection.cursor() as cursor:
             sql = "SELECT `results` FROM " + PLACE_IDS_TABLE + " WHERE `id`=%s"
             cursor.execute(sql, (id, ))
             json_results = cursor.fetchone()
-    finally:
-        connection.close()
 
     return json_results
 
 
 def get_place_id_list(json_results):
-    results_row_data = json.loads(json_results['results'])['results']
-
-    place_ids = []
-    for place in results_row_data:
-        place_ids.append(place['place_id'])
-
-    return place_ids
+    return extract_place_ids(json_results['results'])
 
 
 def insert_place_details_result(place_id, language, place_details_result):
-    connection = get_mysql_connection()
-    try:
-        with connection.cursor() as cursor:
-            # Create a new record
-            sql = "INSERT INTO `" + PLACE_DETAILS_TABLE + "` (`place_id`, `language`, `results`) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE `results` = %s;"
-            cursor.execute(
-                sql, (place_id, language, json.dumps(place_details_result),
-                      json.dumps(place_details_result)))
-        connection.commit()
-    finally:
-        connection.close()
+    store_place_details(PLACE_DETAILS_TABLE, place_id, language,
+                        place_details_result, fields)
 
 
 def insert_place_details_result_failed(place_id, language,
                                        place_details_result):
-    connection = get_mysql_connection()
-    try:
+    batch_writer = get_batch_writer(
+        PLACE_DETAILS_FAILED_TABLE, ('place_id', 'language', 'results'),
+        update_columns=('results', ))
+    batch_writer.add(place_id, language, dumps(place_details_result))
+
+
+def select_max_id():
+    with get_mysql_pool().connection() as connection:
         with connection.cursor() as cursor:
-            sql = "INSERT INTO `" + PLACE_DETAILS_FAILED_TABLE + "` (`place_id`, `language`, `results`) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE `results` = %s;"
-            cursor.execute(
-                sql, (place_id, language, json.dumps(place_details_result),
-                      json.dumps(place_details_result)))
-        connection.commit()
-    finally:
-        connection.close()
+            sql = "SELECT MAX(`id`) AS `max_id` FROM " + PLACE_IDS_TABLE
+            cursor.execute(sql)
+            max_id = cursor.fetchone()['max_id']
+
+    return max_id or 0
+
+
+def iter_place_ids(id_start, id_end):
+    # The next chunk is read while the current one is being requested
+    chunks = prefetch(
+        iter_keyset_chunks(
+            PLACE_IDS_TABLE, ('place_id', ),
+            chunk_size=1000,
+            id_start=id_start,
+            id_end=id_end))
+
+    for places in chunks:
+        for place in places:
+            place_id = place.get('place_id')
+            logger.debug("Place ID: %s Language: %s", place_id,
+                         PLACE_DETAILS_LANG)
+
+            yield place_id
+
+
+def request_place_ids(id_start, id_end, concurrency=1):
+    run_bounded(
+        lambda place_id: request_place_details(place_id, PLACE_DETAILS_LANG),
+        iter_place_ids(id_start, id_end), concurrency)
 
 
 def main():
@@ -160,36 +156,51 @@ def main():
     parser.add_argument(
         '-s', help='The starting ID of Place ID table', default='0')
     parser.add_argument('-e', help='The end ID of Place ID table', default='0')
+    parser.add_argument(
+        '-c',
+        help='The number of place details requests kept in flight',
+        default='1')
+    parser.add_argument(
+        '--fields',
+        help='A comma separated Place Details field mask, e.g. name,geometry/location,photo',
+        default=PLACE_DETAILS_FIELDS)
+    parser.add_argument(
+        '--force',
+        help='Request again even if the result is already stored',
+        action='store_true')
+    parser.add_argument(
+        '--lease',
+        help='A job name; place ids are claimed in chunks shared with other nodes',
+        default=None)
+    parser.add_argument(
+        '--chunk', help='The number of place ids in a leased chunk', default='1000')
     args = parser.parse_args()
 
-    id_start = int(args.s)
-    id_end = int(args.e)
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL") or "INFO",
+        format="%(asctime)s %(levelname)s %(message)s")
+    start_metrics()
 
-    connection = get_mysql_connection()
-    try:
-        with connection.cursor() as cursor:
-            sql = "SELECT `place_id` FROM " + PLACE_IDS_TABLE + " WHERE 1"
+    global fields, force
+    fields = parse_fields(args.fields)
+    force = args.force
+    if not force:
+        get_place_details_index()
 
-            if id_start > 0:
-                sql += " AND `id` >= " + str(id_start)
+    id_start = int(args.s)
+    id_end = int(args.e)
+    concurrency = int(args.c)
 
-            if id_end > 0:
-                sql += " AND `id` <= " + str(id_end)
+    if args.lease is None:
+        request_place_ids(id_start, id_end, concurrency)
+        return
 
-            print("Execute SQL...", datetime.now())
-            cursor.execute(sql)
+    if id_end <= 0:
+        id_end = select_max_id()
 
-            place = cursor.fetchone()
-            while place is not None:
-                place_id = place.get('place_id')
-                language = PLACE_DETAILS_LANG
-                print("Place ID:", place_id, "Language:", language,
-                      datetime.now())
-
-                request_place_details(place_id, language)
-                place = cursor.fetchone()
-    finally:
-        connection.close()
+    for chunk_start, chunk_end in iter_leased_ranges(
+            args.lease, max(id_start, 1), id_end, int(args.chunk)):
+        request_place_ids(chunk_start, chunk_end, concurrency)
 
 
 if __name__ == "__main__":
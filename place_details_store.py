@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from batch_writer import get_batch_writer
+from codec import dumps
+from compression import compress_results, is_compression_enabled
+from fetched_index import find_fetched_index
+from photo_references import insert_photo_references
+from place_fields import project_place_details
+
+
+def store_place_details(table, place_id, language, place_details_result,
+                        fields):
+    """Store the details of a place and the photo references in them.
+
+    The place is added to the fetched index of `table` when this process
+    loaded one; it is never loaded with --force.
+    """
+    place_details_result = project_place_details(place_details_result, fields)
+    payload = dumps(place_details_result)
+
+    if is_compression_enabled():
+        results, results_compressed = None, compress_results(payload)
+    else:
+        # Readers prefer a compressed copy, so one stored earlier is cleared
+        results, results_compressed = payload, None
+
+    batch_writer = get_batch_writer(
+        table,
+        ('place_id', 'language', 'results', 'results_compressed',
+         'created_at', 'updated_at'),
+        update_columns=('results', 'results_compressed', 'updated_at'))
+    batch_writer.add(place_id, language, results, results_compressed,
+                     datetime.now(), datetime.now())
+
+    insert_photo_references(place_id, language, place_details_result)
+
+    fetched_index = find_fetched_index(table)
+    if fetched_index is not None:
+        fetched_index.add((place_id, language))
+
+    return place_details_result
@@ -0,0 +1,89 @@
+from googlemaps.places import PLACES_DETAIL_FIELDS
+
+# Place Details fields whose response key is not the field name
+RESPONSE_KEYS = {
+    'address_component': 'address_components',
+    'photo': 'photos',
+    'review': 'reviews',
+    'type': 'types',
+}
+
+# Kept in every projection so that stored rows stay readable
+ENVELOPE_KEYS = ('html_attributions', 'status')
+
+
+def parse_fields(value):
+    """A comma separated field mask as a list, or None for every field."""
+    if not value:
+        return None
+
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+
+    invalid = [
+        field for field in fields
+        if field.split('/')[0] not in PLACES_DETAIL_FIELDS
+    ]
+    if invalid:
+        raise ValueError("Invalid Place Details fields: " + ", ".join(invalid))
+
+    return fields or None
+
+
+def request_fields(fields):
+    """The top level fields of the mask, the only ones the API takes."""
+    request = []
+    for field in fields:
+        field = field.split('/')[0]
+        if field not in request:
+            request.append(field)
+
+    return request
+
+
+def build_mask(fields):
+    mask = {}
+
+    for field in fields:
+        node = mask
+        parts = field.split('/')
+        parts[0] = RESPONSE_KEYS.get(parts[0], parts[0])
+
+        for part in parts:
+            # An empty node means the whole value, which a parent field asked for
+            if part in node and not node[part]:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node.clear()
+
+    return mask
+
+
+def project(value, mask):
+    if not mask:
+        return value
+
+    if isinstance(value, list):
+        return [project(item, mask) for item in value]
+
+    if isinstance(value, dict):
+        return {
+            key: project(item, mask[key])
+            for key, item in value.items() if key in mask
+        }
+
+    return value
+
+
+def project_place_details(place_details_result, fields):
+    """Strip the keys of a details response that are not in `fields`."""
+    if not fields or 'result' not in place_details_result:
+        return place_details_result
+
+    projected = {
+        key: place_details_result[key]
+        for key in ENVELOPE_KEYS if key in place_details_result
+    }
+    projected['result'] = project(place_details_result['result'],
+                                  build_mask(fields))
+    return projected
@@ -1,22 +1,27 @@
 import argparse
-import json
+import logging
 import os
-import random
-import sys
-from datetime import datetime
 from os.path import dirname, join
-from time import sleep
 
-import requests
 from dotenv import load_dotenv
 
-import pymysql.cursors
+from batch_writer import get_batch_writer
+from client_pool import get_base_url, get_client_pool
+from concurrency import run_bounded
+from fetched_index import get_fetched_index
+from metrics import record_skip, start_metrics
+from photo_references import (extract_compressed_photo_references,
+                              extract_photo_references, iter_photo_references,
+                              select_max_id)
+from response_cache import cached_response
+from retry import redirect_status, request_with_retries
+from work_lease import iter_leased_ranges
 
 dotenv_path = join(dirname(__file__), '.env')
 load_dotenv(dotenv_path, override=True)
 
-GOOGLE_PLACES_API_KEYS = os.environ.get("GOOGLE_PLACES_API_KEYS").split(",")
-PLACE_DETAILS_LANG = os.environ.get("PLACE_DETAILS_LANG")
+logger = logging.getLogger(__name__)
+
 PLACE_DETAILS_TABLE = os.environ.get("PLACE_DETAILS_TABLE")
 PLACE_PHOTOS_TABLE = os.environ.get("PLACE_PHOTOS_TABLE")
 PLACE_PHOTOS_FAILED_TABLE = os.environ.get("PLACE_PHOTOS_FAILED_TABLE")
@@ -32,12 +37,24 @@ CREATE TABLE `place_photos` (
 """
 
 
-def get_random_key():
-    return random.choice(GOOGLE_PLACES_API_KEYS)
+force = False
+
+
+def get_place_photos_index():
+    return get_fetched_index(PLACE_PHOTOS_TABLE, ('photo_reference', ))
 
 
 def request_place_photo(photo_reference):
-    place_photo_result, success = get_place_photo_result(photo_reference)
+    if not force and get_place_photos_index().contains((photo_reference, )):
+        logger.debug("Already fetched: %s", photo_reference)
+        record_skip('photo')
+        return
+
+    result = get_place_photo_result(photo_reference)
+    if result is None:
+        return
+
+    place_photo_result, success = result
     if success:
         insert_place_photo_result(photo_reference, place_photo_result)
     else:
@@ -45,150 +62,134 @@ def request_place_photo(photo_reference):
 
 
 def get_place_photo_result(photo_reference):
-    place_photo_result = None
-    success = False
-
-    for attempt in range(10):
-        sleep(0.05)
-        key = get_random_key()
-
-        print("Get place details result:", photo_reference, datetime.now())
-
-        try:
-            payload = {
-                'key': key,
-                'photoreference': photo_reference,
-                'maxwidth': '800'
-            }
-            place_photo_result = requests.get(
-                "https://maps.googleapis.com/maps/api/place/photo",
-                params=payload).url
-        except:
-            print("Unexpected error:", sys.exc_info()[0])
-            place_photo_result = "Unexpected error:" + str(sys.exc_info())
-            print("Sleep a second...")
-            sleep(1)
-        else:
-            print("Got it.")
-            success = True
-            break
-
-    return (place_photo_result, success)
-
-
-def get_mysql_connection():
-    MYSQL_HOST = os.environ.get("MYSQL_HOST")
-    MYSQL_USER = os.environ.get("MYSQL_USER")
-    MYSQL_PASSWORD = os.environ.get("MYSQL_PASSWORD")
-    MYSQL_DB = os.environ.get("MYSQL_DB")
-    MYSQL_CHARSET = os.environ.get("MYSQL_CHARSET")
-
-    connection = pymysql.connect(
-        host=MYSQL_HOST,
-        user=MYSQL_USER,
-        password=MYSQL_PASSWORD,
-        db=MYSQL_DB,
-        charset=MYSQL_CHARSET,
-        cursorclass=pymysql.cursors.DictCursor)
+    """(photo URL, True), (error, False), or None on an offline cache miss.
 
-    return connection
+    Only the URL of a successful lookup is cached, so every script reading
+    the cache gets the same shape back.
+    """
+    params = {'photoreference': photo_reference, 'maxwidth': '800'}
+    failures = []
 
+    def request():
+        place_photo_result, success = fetch_place_photo_result(photo_reference)
+        if success:
+            return place_photo_result
 
-def select_all(limit=None, offset=None):
-    connection = get_mysql_connection()
-    try:
-        with connection.cursor() as cursor:
-            sql = "SELECT `place_id`, `language` FROM " + PLACE_DETAILS_TABLE + " WHERE `results` LIKE '%photo_reference%' ORDER BY `created_at`"
+        failures.append(place_photo_result)
 
-            if limit is not None:
-                sql += " LIMIT "
-                if offset is not None:
-                    sql += str(offset) + ", "
-                sql += str(limit)
-            
-            cursor.execute(sql)
-            place_details_keys = cursor.fetchall()
-    finally:
-        connection.close()
+    url = cached_response(
+        'photo', params, request, cacheable=lambda url: url is not None)
+    if url is not None:
+        return (url, True)
 
-    return place_details_keys
+    if failures:
+        return (failures[0], False)
 
 
-def select_place_details_result(place_id, language):
-    print("=== Place Details: ", place_id, language, "===")
-
-    connection = get_mysql_connection()
-
-    try:
-        with connection.cursor() as cursor:
-            sql = "SELECT `results` FROM " + PLACE_DETAILS_TABLE + " WHERE `place_id`=%s AND `language`=%s"
-            cursor.execute(sql, (place_id, language))
-            json_results = cursor.fetchone()
-    finally:
-        connection.close()
-
-    return json_results
+def fetch_place_photo_result(photo_reference):
+    logger.debug("Get place photo result: %s", photo_reference)
+    response, success = request_with_retries(
+        'photo',
+        lambda key: get_photo_redirect(key, photo_reference),
+        response_status=redirect_status)
 
+    if success:
+        return (response.headers['Location'], True)
 
-def get_photo_reference_list(json_results):
-    results_row_data = json.loads(json_results['results'])['result']['photos']
+    return (response, False)
 
-    photo_references = []
-    for photo in results_row_data:
-        photo_references.append(photo['photo_reference'])
 
-    return photo_references
+def get_photo_redirect(key, photo_reference):
+    payload = {
+        'key': key,
+        'photoreference': photo_reference,
+        'maxwidth': '800'
+    }
+    # Read the redirect target without downloading the image
+    response = get_client_pool().get_session(key).get(
+        get_base_url() + "/maps/api/place/photo",
+        params=payload,
+        allow_redirects=False,
+        stream=True)
+    response.close()
+    return response
 
 
 def insert_place_photo_result(photo_reference, place_photo_result):
-    connection = get_mysql_connection()
-    try:
-        with connection.cursor() as cursor:
-            sql = "INSERT INTO `" + PLACE_PHOTOS_TABLE + "` (`photo_reference`, `results`) VALUES (%s, %s) ON DUPLICATE KEY UPDATE `results` = %s;"
-            cursor.execute(
-                sql, (photo_reference, place_photo_result, place_photo_result))
-        connection.commit()
-    finally:
-        connection.close()
+    batch_writer = get_batch_writer(
+        PLACE_PHOTOS_TABLE, ('photo_reference', 'results'),
+        update_columns=('results', ))
+    batch_writer.add(photo_reference, place_photo_result)
+
+    if not force:
+        get_place_photos_index().add((photo_reference, ))
 
 
 def insert_place_photo_result_failed(photo_reference, place_photo_result):
-    connection = get_mysql_connection()
-    try:
-        with connection.cursor() as cursor:
-            sql = "INSERT INTO `" + PLACE_PHOTOS_FAILED_TABLE + "` (`photo_reference`, `results`) VALUES (%s, %s) ON DUPLICATE KEY UPDATE `results` = %s;"
-            cursor.execute(
-                sql, (photo_reference, place_photo_result, place_photo_result))
-        connection.commit()
-    finally:
-        connection.close()
+    batch_writer = get_batch_writer(
+        PLACE_PHOTOS_FAILED_TABLE, ('photo_reference', 'results'),
+        update_columns=('results', ))
+    batch_writer.add(photo_reference, place_photo_result)
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-l', help='The limit order by created_at')
-    parser.add_argument('-o', help='The offset order by created_at')
+    parser.add_argument(
+        '-s', help='The starting ID of place_photo_references', default='0')
+    parser.add_argument(
+        '-e', help='The end ID of place_photo_references', default='0')
+    parser.add_argument(
+        '-c',
+        help='The number of photo requests kept in flight',
+        default='1')
+    parser.add_argument(
+        '--extract',
+        help='Extract the photo references of the stored place details first',
+        action='store_true')
+    parser.add_argument(
+        '--force',
+        help='Request again even if the result is already stored',
+        action='store_true')
+    parser.add_argument(
+        '--lease',
+        help='A job name; photo references are claimed in chunks shared with other nodes',
+        default=None)
+    parser.add_argument(
+        '--chunk', help='The number of photo references in a leased chunk',
+        default='1000')
     args = parser.parse_args()
 
-    if args.l is not None:
-        limit = int(args.l)
-    else:
-        limit = None
-
-    if args.o is not None:
-        offset = int(args.o)
-    else:
-        offset = None
-
-    place_details_keys = select_all(limit, offset)
-
-    for place_details_key in place_details_keys:
-        json_results = select_place_details_result(
-            place_details_key['place_id'], place_details_key['language'])
-
-        photo_references = get_photo_reference_list(json_results)
-        for photo_reference in photo_references:
-            request_place_photo(photo_reference)
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL") or "INFO",
+        format="%(asctime)s %(levelname)s %(message)s")
+    start_metrics()
+
+    if args.extract:
+        extract_photo_references(PLACE_DETAILS_TABLE)
+        # Rows compressed earlier are there even if compression is off now
+        extract_compressed_photo_references(PLACE_DETAILS_TABLE)
+
+    global force
+    force = args.force
+    if not force:
+        get_place_photos_index()
+
+    id_start = int(args.s)
+    id_end = int(args.e)
+    concurrency = int(args.c)
+
+    if args.lease is None:
+        run_bounded(request_place_photo,
+                    iter_photo_references(id_start, id_end), concurrency)
+        return
+
+    if id_end <= 0:
+        id_end = select_max_id()
+
+    for chunk_start, chunk_end in iter_leased_ranges(
+            args.lease, max(id_start, 1), id_end, int(args.chunk)):
+        run_bounded(request_place_photo,
+                    iter_photo_references(chunk_start, chunk_end), concurrency)
 
 
 if __name__ == "__main__":
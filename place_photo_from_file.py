@@ -1,98 +1,124 @@
+import argparse
+import logging
 import os
-import random
-import sys
+from itertools import islice
 from datetime import datetime
 from os.path import dirname, join
-from time import sleep
 
-import requests
 from dotenv import load_dotenv
 
-import pymysql.cursors
+from batch_writer import get_batch_writer
+from concurrency import run_bounded
+from fetched_index import get_fetched_index
+from metrics import record_skip, start_metrics
+from place_photo import get_place_photo_result
+from work_lease import iter_leased_ranges
 
 dotenv_path = join(dirname(__file__), '.env')
 load_dotenv(dotenv_path, override=True)
 
-GOOGLE_PLACES_API_KEYS = os.environ.get("GOOGLE_PLACES_API_KEYS").split(",")
+logger = logging.getLogger(__name__)
+
 PLACE_PHOTOS_TABLE = os.environ.get("PLACE_PHOTOS_TABLE")
+PLACE_PHOTOS_FAILED_TABLE = os.environ.get("PLACE_PHOTOS_FAILED_TABLE")
 PLACE_PHOTOS_FILE = os.environ.get("PLACE_PHOTOS_FILE")
 
 
-def get_random_key():
-    return random.choice(GOOGLE_PLACES_API_KEYS)
+force = False
+
+
+def get_place_photos_index():
+    return get_fetched_index(PLACE_PHOTOS_TABLE, ('photo_reference', ))
 
 
 def request_place_photos(photo_reference):
-    place_photos_result = get_place_photos_result(photo_reference)
-    insert_place_photos_result(photo_reference, place_photos_result)
-
-
-def get_place_photos_result(photo_reference):
-    place_photos_result = None
-
-    for attempt in range(10):
-        sleep(0.05)
-        key = get_random_key()
-
-        print("Get place details result:", photo_reference, datetime.now())
-
-        try:
-            payload = {
-                'key': key,
-                'photoreference': photo_reference,
-                'maxwidth': '800'
-            }
-            place_photos_result = requests.get(
-                "https://maps.googleapis.com/maps/api/place/photo",
-                params=payload).url
-        except:
-            print("Unexpected error:", sys.exc_info()[0])
-            place_photos_result = "Unexpected error:" + str(sys.exc_info())
-            print("Sleep a second...")
-            sleep(1)
-        else:
-            print("Got it.")
-            break
-
-    return place_photos_result
-
-
-def get_mysql_connection():
-    MYSQL_HOST = os.environ.get("MYSQL_HOST")
-    MYSQL_USER = os.environ.get("MYSQL_USER")
-    MYSQL_PASSWORD = os.environ.get("MYSQL_PASSWORD")
-    MYSQL_DB = os.environ.get("MYSQL_DB")
-    MYSQL_CHARSET = os.environ.get("MYSQL_CHARSET")
-
-    connection = pymysql.connect(
-        host=MYSQL_HOST,
-        user=MYSQL_USER,
-        password=MYSQL_PASSWORD,
-        db=MYSQL_DB,
-        charset=MYSQL_CHARSET,
-        cursorclass=pymysql.cursors.DictCursor)
-
-    return connection
+    if not force and get_place_photos_index().contains((photo_reference, )):
+        logger.debug("Already fetched: %s", photo_reference)
+        record_skip('photo')
+        return
+
+    # Shared with place_photo.py, which caches the same lookups
+    result = get_place_photo_result(photo_reference)
+    if result is None:
+        return
+
+    place_photos_result, success = result
+    if success:
+        insert_place_photos_result(photo_reference, place_photos_result)
+    else:
+        insert_place_photos_result_failed(photo_reference, place_photos_result)
 
 
 def insert_place_photos_result(photo_reference, place_photos_result):
-    connection = get_mysql_connection()
-    try:
-        with connection.cursor() as cursor:
-            # Create a new record
-            sql = "INSERT INTO `" + PLACE_PHOTOS_TABLE + "` (`photo_reference`, `results`, `created_at`, `updated_at`) VALUES (%s, %s, %s, %s)"
-            cursor.execute(sql, (photo_reference, place_photos_result,
-                                 datetime.now(), datetime.now()))
-        connection.commit()
-    finally:
-        connection.close()
+    batch_writer = get_batch_writer(
+        PLACE_PHOTOS_TABLE,
+        ('photo_reference', 'results', 'created_at', 'updated_at'),
+        update_columns=('results', 'updated_at'))
+    batch_writer.add(photo_reference, place_photos_result, datetime.now(),
+                     datetime.now())
+
+    if not force:
+        get_place_photos_index().add((photo_reference, ))
+
+
+def insert_place_photos_result_failed(photo_reference, place_photos_result):
+    batch_writer = get_batch_writer(
+        PLACE_PHOTOS_FAILED_TABLE,
+        ('photo_reference', 'results', 'created_at', 'updated_at'),
+        update_columns=('results', 'updated_at'))
+    batch_writer.add(photo_reference, place_photos_result, datetime.now(),
+                     datetime.now())
+
+
+def request_lines(line_start, line_end, concurrency):
+    stop = None if line_end is None else line_end + 1
+
+    with open(PLACE_PHOTOS_FILE) as input_file:
+        photo_references = (line.strip()
+                            for line in islice(input_file, line_start, stop))
+        run_bounded(request_place_photos, photo_references, concurrency)
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-c',
+        help='The number of photo requests kept in flight',
+        default='1')
+    parser.add_argument(
+        '--force',
+        help='Request again even if the result is already stored',
+        action='store_true')
+    parser.add_argument(
+        '--lease',
+        help='A job name; lines are claimed in chunks shared with other nodes',
+        default=None)
+    parser.add_argument(
+        '--chunk', help='The number of lines in a leased chunk', default='1000')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL") or "INFO",
+        format="%(asctime)s %(levelname)s %(message)s")
+    start_metrics()
+
+    global force
+    force = args.force
+    if not force:
+        get_place_photos_index()
+
+    concurrency = int(args.c)
+
+    if args.lease is None:
+        request_lines(0, None, concurrency)
+        return
+
     with open(PLACE_PHOTOS_FILE) as input_file:
-        for line in input_file:
-            photo_reference = line.strip()
-            request_place_photos(photo_reference)
+        line_count = sum(1 for line in input_file)
+
+    for chunk_start, chunk_end in iter_leased_ranges(
+            args.lease, 0, line_count - 1, int(args.chunk)):
+        request_lines(chunk_start, chunk_end, concurrency)
 
 
 if __name__ == "__main__":
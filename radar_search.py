@@ -1,149 +1,163 @@
 import argparse
-import json
+import logging
+import math
 import os
-import random
-import sys
 from datetime import datetime
 from os.path import dirname, join
-from time import sleep
 
-import googlemaps
+import numpy as np
 from dotenv import load_dotenv
 
-import pymysql.cursors
+from batch_writer import flush_all, get_batch_writer
+from checkpoint import CheckpointJournal
+from client_pool import get_client_pool
+from codec import dumps
+from coverage import (box_area, cell_centers, circles_intersect, grid_centers,
+                      hex_centers, load_polygons, overlap_ratio)
+from metrics import start_metrics
+from response_cache import cached_response
+from retry import request_with_retries
+from work_lease import iter_leased_ranges
 
 dotenv_path = join(dirname(__file__), '.env')
 load_dotenv(dotenv_path, override=True)
 
-GOOGLE_PLACES_API_KEYS = os.environ.get("GOOGLE_PLACES_API_KEYS").split(",")
+logger = logging.getLogger(__name__)
+
 PLACE_TYPES = os.environ.get("PLACE_TYPES").split(",")
 RADAR_SEARCHS_TABLE = os.environ.get("RADAR_SEARCHS_TABLE")
 RADAR_SEARCHS_FAILED_TABLE = os.environ.get("RADAR_SEARCHS_FAILED_TABLE")
 
-query_times = 0
-
-
-def frange(start, stop, step):
-    x = start
-    while x < stop:
-        yield x
-        x += step
+# Radar Search returns at most 200 places per request
+RADAR_RESULT_CAP = 200
+METERS_PER_DEGREE = 111320
 
 
-def check_query_times():
-    global query_times
-    query_times += 1
-    sleep(0.05)
+def meters_to_lat(meters):
+    return meters / METERS_PER_DEGREE
 
-    if query_times >= 40:
-        # print("Sleep a second.\n")
-        # sleep(1)
-        query_times = 0
 
+def meters_to_lng(meters, lat):
+    return meters / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
 
-def get_gmaps():
-    gmaps = googlemaps.Client(key=random.choice(GOOGLE_PLACES_API_KEYS))
-    return gmaps
 
-
-def radar_search(lat, lng, radius):
+def radar_search(lat, lng, radius, place_types=None):
     location = (lat, lng)
-    for place_type in PLACE_TYPES:
+    results = {}
+    for place_type in place_types or PLACE_TYPES:
         places_radar_result = get_radar_result(location, radius, place_type)
+        if places_radar_result is None:
+            continue
 
+        # The request was already retried within the item's retry budget
         if type(places_radar_result) is dict:
-            # If the query fails
-            if places_radar_result['status'] != 'OK' and places_radar_result['status'] != 'ZERO_RESULTS':
-                # retry
-                places_radar_result = get_radar_result(location, radius,
-                                                       place_type)
-
-            # If it still fails
-            if places_radar_result['status'] != 'OK' and places_radar_result['status'] != 'ZERO_RESULTS':
-                insert_radar_result_failed(location, radius, place_type,
-                                        places_radar_result)
-            else:
-                insert_radar_result(location, radius, place_type,
-                                    places_radar_result)
+            insert_radar_result(location, radius, place_type,
+                                places_radar_result)
         else:
-            print("Failed.")
+            print("Failed:", location, radius, place_type)
             insert_radar_result_failed(location, radius, place_type,
                                        places_radar_result)
 
+        results[place_type] = places_radar_result
 
-def get_radar_result(location, radius, place_type):
-    places_radar_result = None
-
-    for attempt in range(5):
-        check_query_times()
-        gmaps = get_gmaps()
-
-        print("Get radar result:", location, radius, place_type,
-              datetime.now())
-
-        try:
-            # raise googlemaps.exceptions.TransportError()
-            places_radar_result = gmaps.places_radar(
-                location, radius, type=place_type)
-        except:
-            print("Unexpected error:", sys.exc_info()[0])
-            places_radar_result = "Unexpected error:" + str(sys.exc_info()[0])
-            print("Sleep 10 seconds...")
-            sleep(10)
-        else:
-            print("Got it.")
-            break
+    return results
 
-    return places_radar_result
 
+def is_saturated(places_radar_result):
+    return type(places_radar_result) is dict and len(
+        places_radar_result.get('results', [])) >= RADAR_RESULT_CAP
+
+
+def adaptive_radar_search(lat, lng, half_size, min_radius, place_types=None):
+    """Search a cell and split it while it is dense.
+
+    Returns False when a search in the cell was skipped (an offline cache
+    miss), so that the cell isn't counted as done.
+    """
+    place_types = place_types or PLACE_TYPES
+    # The search circle circumscribes the square cell
+    radius = max(min_radius, int(math.ceil(half_size * math.sqrt(2))))
+    results = radar_search(lat, lng, radius, place_types)
+    complete = len(results) == len(place_types)
 
-def get_mysql_connection():
-    MYSQL_HOST = os.environ.get("MYSQL_HOST")
-    MYSQL_USER = os.environ.get("MYSQL_USER")
-    MYSQL_PASSWORD = os.environ.get("MYSQL_PASSWORD")
-    MYSQL_DB = os.environ.get("MYSQL_DB")
-    MYSQL_CHARSET = os.environ.get("MYSQL_CHARSET")
+    # Only the types that hit the result cap are searched again in smaller cells
+    dense_types = [
+        place_type for place_type, places_radar_result in results.items()
+        if is_saturated(places_radar_result)
+    ]
+    if not dense_types or radius <= min_radius:
+        return complete
 
-    connection = pymysql.connect(
-        host=MYSQL_HOST,
-        user=MYSQL_USER,
-        password=MYSQL_PASSWORD,
-        db=MYSQL_DB,
-        charset=MYSQL_CHARSET,
-        cursorclass=pymysql.cursors.DictCursor)
+    quarter_size = half_size / 2
+    lat_offset = meters_to_lat(quarter_size)
+    lng_offset = meters_to_lng(quarter_size, lat)
 
-    return connection
+    for sub_lat in (lat - lat_offset, lat + lat_offset):
+        for sub_lng in (lng - lng_offset, lng + lng_offset):
+            if not adaptive_radar_search(sub_lat, sub_lng, quarter_size,
+                                         min_radius, dense_types):
+                complete = False
+
+    return complete
+
+
+def search_cells(cell_indexes, center_lats, center_lngs, radius,
+                 half_size=None, journal=None):
+    for cell_index, lat, lng in zip(cell_indexes.tolist(), center_lats.tolist(),
+                                    center_lngs.tolist()):
+        if journal is not None and journal.is_cell_done(cell_index,
+                                                        PLACE_TYPES):
+            continue
+
+        for place_type in PLACE_TYPES:
+            if journal is not None and journal.is_done(cell_index, place_type):
+                continue
+
+            if half_size is not None:
+                done = adaptive_radar_search(lat, lng, half_size, radius,
+                                             [place_type])
+            else:
+                done = place_type in radar_search(lat, lng, radius,
+                                                  [place_type])
+
+            # A search skipped on an offline cache miss is left for a later run
+            if journal is not None and done:
+                journal.mark(cell_index, place_type)
+
+
+def get_radar_result(location, radius, place_type):
+    params = {'location': location, 'radius': radius, 'type': place_type}
+    return cached_response(
+        'radarsearch', params,
+        lambda: fetch_radar_result(location, radius, place_type))
+
+
+def fetch_radar_result(location, radius, place_type):
+    logger.debug("Get radar result: %s %s %s", location, radius, place_type)
+    places_radar_result, success = request_with_retries(
+        'radarsearch',
+        lambda key: get_client_pool().get_gmaps(key).places_radar(
+            location, radius, type=place_type))
+    return places_radar_result
 
 
 def insert_radar_result(location, radius, place_type, places_radar_result):
-    connection = get_mysql_connection()
-    try:
-        with connection.cursor() as cursor:
-            # Create a new record
-            sql = "INSERT INTO `" + RADAR_SEARCHS_TABLE + "` (`location`, `radius`, `type`, `results`, `created_at`, `updated_at`) VALUES (%s, %s, %s, %s, %s, %s)"
-            cursor.execute(sql,
-                           (str(location), radius, place_type,
-                            json.dumps(places_radar_result), datetime.now(),
-                            datetime.now()))
-        connection.commit()
-    finally:
-        connection.close()
+    batch_writer = get_batch_writer(
+        RADAR_SEARCHS_TABLE,
+        ('location', 'radius', 'type', 'results', 'created_at', 'updated_at'))
+    batch_writer.add(
+        str(location), radius, place_type, dumps(places_radar_result),
+        datetime.now(), datetime.now())
 
 
 def insert_radar_result_failed(location, radius, place_type,
                                places_radar_result):
-    connection = get_mysql_connection()
-    try:
-        with connection.cursor() as cursor:
-            # Create a new record
-            sql = "INSERT INTO `" + RADAR_SEARCHS_FAILED_TABLE + "` (`location`, `radius`, `type`, `results`, `created_at`, `updated_at`) VALUES (%s, %s, %s, %s, %s, %s)"
-            cursor.execute(sql,
-                           (str(location), radius, place_type,
-                            json.dumps(places_radar_result), datetime.now(),
-                            datetime.now()))
-        connection.commit()
-    finally:
-        connection.close()
+    batch_writer = get_batch_writer(
+        RADAR_SEARCHS_FAILED_TABLE,
+        ('location', 'radius', 'type', 'results', 'created_at', 'updated_at'))
+    batch_writer.add(
+        str(location), radius, place_type, dumps(places_radar_result),
+        datetime.now(), datetime.now())
 
 
 def main():
@@ -173,8 +187,43 @@ def main():
         help='Last stop point of longitude measurement',
         default=None)
     parser.add_argument('-r', help='radius', default='125')
+    parser.add_argument(
+        '--adaptive',
+        help='Split a cell into four only when its results are saturated',
+        action='store_true')
+    parser.add_argument(
+        '--cell',
+        help='The starting cell size in meters of the adaptive mode',
+        default='5000')
+    parser.add_argument(
+        '--hex',
+        help='Cover the area with hexagonally packed circles of radius -r',
+        action='store_true')
+    parser.add_argument(
+        '--polygon',
+        help='A GeoJSON (Multi)Polygon file; circles outside it are skipped',
+        default=None)
+    parser.add_argument(
+        '--journal',
+        help='A checkpoint journal file; finished cells are skipped on restart',
+        default=None)
+    parser.add_argument(
+        '--lease',
+        help='A job name; cells are claimed in chunks shared with other nodes',
+        default=None)
+    parser.add_argument(
+        '--chunk', help='The number of cells in a leased chunk', default='1000')
+    parser.add_argument(
+        '--dry-run',
+        help='Only report the planned number of requests',
+        action='store_true')
     args = parser.parse_args()
 
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL") or "INFO",
+        format="%(asctime)s %(levelname)s %(message)s")
+    start_metrics()
+
     lat_start = float(args.lat1)
     lng_start = float(args.lng1)
     lat_end = float(args.lat2)
@@ -188,18 +237,81 @@ def main():
     if lng_start > lng_end:
         lng_start, lng_end = lng_end, lng_start
 
-    if (args.lastlat is not None) and (args.lastlng is not None):
-        lat_last = float(args.lastlat)
-        lng_last = float(args.lastlng)
+    half_size = None
+    if args.adaptive:
+        half_size = float(args.cell) / 2
+        center_lats, center_lngs = cell_centers(lat_start, lng_start, lat_end,
+                                                lng_end, float(args.cell))
+        search_radius = half_size * math.sqrt(2)
+    elif args.hex:
+        center_lats, center_lngs = hex_centers(lat_start, lng_start, lat_end,
+                                               lng_end, radius)
+        search_radius = radius
+    else:
+        last_lats, last_lngs = np.empty(0), np.empty(0)
+        if (args.lastlat is not None) and (args.lastlng is not None):
+            lat_last = float(args.lastlat)
+            lng_last = float(args.lastlng)
+
+            last_lats, last_lngs = grid_centers(lat_last, lng_last,
+                                                lat_last + step / 2, lng_end,
+                                                step, step)
+
+            lat_start = lat_last + step
+
+        center_lats, center_lngs = grid_centers(lat_start, lng_start, lat_end,
+                                                lng_end, step, step)
+        center_lats = np.concatenate((last_lats, center_lats))
+        center_lngs = np.concatenate((last_lngs, center_lngs))
+        search_radius = radius
+
+    plan_size = len(center_lats)
+    cell_indexes = np.arange(plan_size)
+    area = box_area(lat_start, lng_start, lat_end, lng_end)
+    print("Circles:", len(center_lats), "Requests:",
+          len(center_lats) * len(PLACE_TYPES), "Overlap ratio:",
+          round(overlap_ratio(len(center_lats), search_radius, area), 3))
+
+    if args.polygon is not None:
+        mask = circles_intersect(center_lats, center_lngs, search_radius,
+                                 load_polygons(args.polygon))
+        skipped = len(mask) - int(mask.sum())
+        print("Clipped to polygon:", int(mask.sum()), "circles kept,",
+              skipped * len(PLACE_TYPES), "requests saved")
+
+        center_lats = center_lats[mask]
+        center_lngs = center_lngs[mask]
+        cell_indexes = cell_indexes[mask]
+
+    if args.dry_run:
+        return
+
+    journal = None
+    if args.journal is not None:
+        # Cell indexes are only meaningful for the same plan
+        plan = " ".join(
+            str(value) for value in
+            ('adaptive' if args.adaptive else 'hex' if args.hex else 'grid',
+             args.lat1, args.lng1, args.lat2, args.lng2, args.lastlat,
+             args.lastlng, radius, args.cell, args.polygon))
+        journal = CheckpointJournal(args.journal, plan, before_sync=flush_all)
 
-        for lng in frange(lng_last, lng_end, step):
-            radar_search(lat_last, lng, radius)
-
-        lat_start = lat_last + step
-
-    for lat in frange(lat_start, lat_end, step):
-        for lng in frange(lng_start, lng_end, step):
-            radar_search(lat, lng, radius)
+    try:
+        if args.lease is None:
+            search_cells(cell_indexes, center_lats, center_lngs, radius,
+                         half_size, journal)
+        else:
+            leased_ranges = iter_leased_ranges(args.lease, 0, plan_size - 1,
+                                               int(args.chunk))
+            for chunk_start, chunk_end in leased_ranges:
+                first, last = np.searchsorted(cell_indexes,
+                                              (chunk_start, chunk_end + 1))
+                search_cells(cell_indexes[first:last],
+                             center_lats[first:last], center_lngs[first:last],
+                             radius, half_size, journal)
+    finally:
+        if journal is not None:
+            journal.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+from datetime import date
+from time import monotonic, sleep
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+# Statuses that say the key, rather than the request, is the problem
+QUARANTINE_STATUSES = ('OVER_QUERY_LIMIT', 'REQUEST_DENIED', 'HTTP_403',
+                       'HTTP_429')
+
+
+class QuotaExhaustedError(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, daily_quota=0):
+        self.rate = rate
+        self.capacity = capacity
+        self.daily_quota = daily_quota
+        self.tokens = capacity
+        self.updated_at = monotonic()
+        self.used_today = 0
+        self.day = date.today()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        today = date.today()
+        if today != self.day:
+            self.day = today
+            self.used_today = 0
+
+    def has_quota(self):
+        return self.daily_quota <= 0 or self.used_today < self.daily_quota
+
+    def take(self):
+        self.tokens -= 1
+        self.used_today += 1
+
+    def wait_time(self):
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class KeyHealth:
+    """Quarantines a key after failures, for longer on every failure in a row."""
+
+    def __init__(self, cooldown, max_cooldown):
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = 0
+        self.quarantined_until = 0.0
+
+    def is_healthy(self, now):
+        return now >= self.quarantined_until
+
+    def succeed(self):
+        self.failures = 0
+
+    def fail(self, now):
+        self.failures += 1
+        cooldown = min(self.max_cooldown,
+                       self.cooldown * 2**(self.failures - 1))
+        self.quarantined_until = now + cooldown
+        return cooldown
+
+
+class KeyRateLimiter:
+    """Hands out API keys, one token bucket per key, least-loaded key first.
+
+    Keys reported as over their limit or denied are quarantined for a
+    cooling period and traffic goes to the healthy keys meanwhile.
+    """
+
+    def __init__(self, keys, qps, burst=None, daily_quota=0, cooldown=30,
+                 max_cooldown=3600):
+        if burst is None:
+            burst = max(1.0, qps)
+
+        self.buckets = {
+            key: TokenBucket(qps, burst, daily_quota)
+            for key in keys
+        }
+        self.health = {
+            key: KeyHealth(cooldown, max_cooldown)
+            for key in keys
+        }
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                candidates = []
+                quarantined_until = []
+                for key, bucket in self.buckets.items():
+                    bucket.refill(now)
+                    if not bucket.has_quota():
+                        continue
+
+                    health = self.health[key]
+                    if health.is_healthy(now):
+                        candidates.append((bucket.tokens, key))
+                    else:
+                        quarantined_until.append(health.quarantined_until)
+
+                if not candidates:
+                    if not quarantined_until:
+                        raise QuotaExhaustedError(
+                            "Daily quota exhausted for every API key")
+
+                    # Every key with quota left is quarantined
+                    wait = min(quarantined_until) - now
+                else:
+                    tokens, key = max(candidates)
+                    bucket = self.buckets[key]
+                    if tokens >= 1:
+                        bucket.take()
+                        return key
+
+                    wait = bucket.wait_time()
+
+            sleep(wait)
+
+    def report(self, key, status):
+        """Record the status of a request made with `key`."""
+        with self.lock:
+            health = self.health[key]
+            if status in QUARANTINE_STATUSES:
+                cooldown = health.fail(monotonic())
+            else:
+                health.succeed()
+                return
+
+        logger.warning("Quarantined key ...%s for %s seconds after %s",
+                       key[-4:], cooldown, status)
+
+
+def get_qps():
+    return float(os.environ.get("GOOGLE_PLACES_QPS") or 10)
+
+
+def get_rate_limiter():
+    global _rate_limiter
+
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            keys = os.environ.get("GOOGLE_PLACES_API_KEYS").split(",")
+            qps = get_qps()
+            daily_quota = int(
+                os.environ.get("GOOGLE_PLACES_DAILY_QUOTA") or 0)
+            cooldown = float(
+                os.environ.get("GOOGLE_PLACES_KEY_COOLDOWN") or 30)
+            _rate_limiter = KeyRateLimiter(
+                keys, qps, daily_quota=daily_quota, cooldown=cooldown)
+
+    return _rate_limiter
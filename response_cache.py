@@ -0,0 +1,172 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from time import time
+
+from codec import dumps, loads
+from metrics import get_metrics
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Successful API responses in an SQLite file, keyed by the request.
+
+    The key is a hash of the endpoint and its parameters without the API
+    key.  Entries older than `ttl` seconds are ignored (0 keeps them
+    forever) and the least recently used entries are evicted once the
+    values take more than `max_bytes` (0 for no limit).  An `offline`
+    cache is only read, so a run can be replayed without the network.
+    """
+
+    def __init__(self, path, ttl=0, max_bytes=0, offline=False):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+
+        if offline:
+            self.connection = sqlite3.connect(
+                'file:' + path + '?mode=ro',
+                uri=True,
+                check_same_thread=False)
+        else:
+            self.connection = sqlite3.connect(
+                path, check_same_thread=False, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, value TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+            )
+
+        self.size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(endpoint, params):
+        request = json.dumps([endpoint, params], sort_keys=True)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get(self, endpoint, params):
+        key = self.make_key(endpoint, params)
+        now = time()
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, created_at FROM responses WHERE key=?",
+                (key, )).fetchone()
+
+            if row is None:
+                return None
+
+            value, created_at = row
+            if self.ttl > 0 and now - created_at > self.ttl:
+                return None
+
+            if not self.offline:
+                self.connection.execute(
+                    "UPDATE responses SET accessed_at=? WHERE key=?",
+                    (now, key))
+
+        return loads(value)
+
+    def put(self, endpoint, params, value):
+        if self.offline:
+            return
+
+        key = self.make_key(endpoint, params)
+        value = dumps(value)
+        size = len(value)
+        now = time()
+
+        with self.lock:
+            old = self.connection.execute(
+                "SELECT size FROM responses WHERE key=?", (key, )).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint, value, size, now, now))
+            self.size += size - (old[0] if old else 0)
+
+            if self.max_bytes > 0 and self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Evict down to 90% so that every put doesn't have to evict again
+        target = self.max_bytes * 0.9
+        rows = self.connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at")
+
+        keys = []
+        for key, size in rows:
+            if self.size <= target:
+                break
+            keys.append((key, ))
+            self.size -= size
+
+        self.connection.executemany("DELETE FROM responses WHERE key=?", keys)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def is_ok_response(response):
+    return type(response) is dict and response.get('status') in ('OK',
+                                                                 'ZERO_RESULTS')
+
+
+def cached_response(endpoint, params, request, cacheable=is_ok_response):
+    """The cached response to a request, or request() stored if cacheable.
+
+    Returns None without calling request() when an offline cache misses.
+    """
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return request()
+
+    response = response_cache.get(endpoint, params)
+    if response is not None:
+        get_metrics().inc(
+            'response_cache_lookups_total', endpoint=endpoint, result='hit')
+        logger.debug("Cache hit: %s %s", endpoint, params)
+        return response
+
+    get_metrics().inc(
+        'response_cache_lookups_total', endpoint=endpoint, result='miss')
+
+    if response_cache.offline:
+        logger.debug("Not cached: %s %s", endpoint, params)
+        return None
+
+    response = request()
+    if cacheable(response):
+        response_cache.put(endpoint, params, response)
+
+    return response
+
+
+def get_response_cache():
+    """The cache configured by RESPONSE_CACHE_PATH, or None without one."""
+    global _response_cache
+
+    with _response_cache_lock:
+        path = os.environ.get("RESPONSE_CACHE_PATH")
+        if _response_cache is None and path:
+            _response_cache = ResponseCache(
+                path,
+                ttl=int(os.environ.get("RESPONSE_CACHE_TTL") or 0),
+                max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_MB") or 0) *
+                1024 * 1024,
+                offline=os.environ.get("RESPONSE_CACHE_OFFLINE") == "1")
+            atexit.register(_response_cache.close)
+
+    return _response_cache
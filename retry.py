@@ -0,0 +1,90 @@
+import os
+import random
+from time import monotonic, sleep
+
+from metrics import error_status, record_request
+from rate_limiter import QUARANTINE_STATUSES, get_rate_limiter
+
+SUCCESS_STATUSES = ('OK', 'ZERO_RESULTS')
+
+# Asking again can't change the answer to these
+FINAL_STATUSES = ('INVALID_REQUEST', 'NOT_FOUND')
+
+
+def is_final(status):
+    # A client error other than a key problem, e.g. an expired photo reference
+    if status.startswith('HTTP_4') and status not in QUARANTINE_STATUSES:
+        return True
+
+    return status in FINAL_STATUSES
+
+
+def api_status(response):
+    return response['status']
+
+
+def redirect_status(response):
+    if 'Location' in response.headers:
+        return 'OK'
+
+    return 'HTTP_' + str(response.status_code)
+
+
+def get_retry_budget():
+    return float(os.environ.get("RETRY_BUDGET_SECONDS") or 60)
+
+
+def backoff_delay(attempt, base, cap):
+    """Full jitter: uniform between 0 and the exponential delay."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def request_with_retries(endpoint, request, response_status=api_status):
+    """Call request(key) with keys from the rate limiter until it succeeds.
+
+    Every item gets RETRY_ATTEMPTS attempts and RETRY_BUDGET_SECONDS of
+    backoff at most, with jittered exponential delays between attempts.
+    The status of every attempt is reported to the rate limiter, which
+    quarantines keys that are over their limit or denied.  Returns
+    (response, True), or ("Unexpected error:...", False) once the budget is
+    spent.
+    """
+    attempts = int(os.environ.get("RETRY_ATTEMPTS") or 5)
+    budget = get_retry_budget()
+    base = float(os.environ.get("RETRY_BASE_DELAY") or 0.5)
+    rate_limiter = get_rate_limiter()
+    deadline = monotonic() + budget
+    failure = None
+
+    for attempt in range(attempts):
+        if attempt > 0 and monotonic() >= deadline:
+            break
+
+        key = rate_limiter.acquire()
+        started = monotonic()
+
+        try:
+            response = request(key)
+        except Exception as error:
+            status = error_status(error)
+            failure = "Unexpected error:" + repr(error)
+        else:
+            status = response_status(response)
+            failure = "Unexpected error:" + status
+
+        record_request(endpoint, key, status, monotonic() - started)
+        rate_limiter.report(key, status)
+
+        if status in SUCCESS_STATUSES:
+            return (response, True)
+
+        if is_final(status) or attempt == attempts - 1:
+            break
+
+        delay = backoff_delay(attempt, base, budget)
+        if monotonic() + delay > deadline:
+            break
+
+        sleep(delay)
+
+    return (failure, False)
@@ -0,0 +1,228 @@
+import argparse
+import logging
+import os
+from datetime import datetime
+from os.path import dirname, join
+
+from dotenv import load_dotenv
+
+import place_details
+from batch_writer import flush_all
+from codec import dumps
+from concurrency import run_bounded
+from keyset import select_chunk
+from metrics import start_metrics
+from mysql_pool import get_mysql_pool
+from place_details_store import store_place_details
+from place_fields import parse_fields
+from place_photo import get_place_photo_result
+from radar_search import get_radar_result
+
+dotenv_path = join(dirname(__file__), '.env')
+load_dotenv(dotenv_path, override=True)
+
+RADAR_SEARCHS_TABLE = os.environ.get("RADAR_SEARCHS_TABLE")
+RADAR_SEARCHS_FAILED_TABLE = os.environ.get("RADAR_SEARCHS_FAILED_TABLE")
+PLACE_DETAILS_TABLE = os.environ.get("PLACE_DETAILS_TABLE")
+PLACE_DETAILS_FAILED_TABLE = os.environ.get("PLACE_DETAILS_FAILED_TABLE")
+PLACE_PHOTOS_TABLE = os.environ.get("PLACE_PHOTOS_TABLE")
+PLACE_PHOTOS_FAILED_TABLE = os.environ.get("PLACE_PHOTOS_FAILED_TABLE")
+
+
+class FailedRows:
+    """How to re-issue the rows of one *_failed table.
+
+    retry(row) returns (True, values of the main table row) on success,
+    (False, new failed results) otherwise, or None to leave the row alone.
+    Without insert_sql, retry stores the row itself through a batch writer.
+    """
+
+    def __init__(self, failed_table, key_columns, columns, insert_sql,
+                 retry):
+        self.failed_table = failed_table
+        self.key_columns = key_columns
+        self.columns = columns
+        self.insert_sql = insert_sql
+        self.retry = retry
+
+    def iter_chunks(self, chunk_size):
+        """Yield the failed rows in primary key order, `chunk_size` at a time."""
+        select = "SELECT " + ", ".join(
+            "`" + column + "`" for column in self.columns
+        ) + " FROM `" + self.failed_table + "`"
+        order = " ORDER BY " + ", ".join(
+            "`" + column + "`" for column in self.key_columns) + " LIMIT %s"
+        after = " WHERE (" + ", ".join(
+            "`" + column + "`" for column in self.key_columns) + ") > (" + ", ".join(
+                ["%s"] * len(self.key_columns)) + ")"
+
+        last_key = None
+        while True:
+            if last_key is None:
+                rows = select_chunk(select + order, (chunk_size, ))
+            else:
+                rows = select_chunk(select + after + order,
+                                    last_key + (chunk_size, ))
+
+            if not rows:
+                return
+
+            yield rows
+
+            if len(rows) < chunk_size:
+                return
+
+            last_key = tuple(rows[-1][column] for column in self.key_columns)
+
+    def key_of(self, row):
+        return tuple(row[column] for column in self.key_columns)
+
+    def commit(self, moved, failed):
+        """Move the successful rows and update the rest in one transaction."""
+        where = " WHERE " + " AND ".join(
+            "`" + column + "`=%s" for column in self.key_columns)
+        delete_sql = "DELETE FROM `" + self.failed_table + "`" + where
+        update_sql = "UPDATE `" + self.failed_table + "` SET `results`=%s, `updated_at`=NOW()" + where
+
+        if moved and self.insert_sql is None:
+            # The rows must be stored before their failed copies are deleted
+            flush_all()
+
+        with get_mysql_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                if moved:
+                    if self.insert_sql is not None:
+                        cursor.executemany(self.insert_sql,
+                                           [values for _, values in moved])
+                    cursor.executemany(delete_sql,
+                                       [key for key, _ in moved])
+                if failed:
+                    cursor.executemany(update_sql, [
+                        (results, ) + key for key, results in failed
+                    ])
+            connection.commit()
+
+
+def retry_radar_search(row):
+    location = tuple(
+        float(value) for value in row['location'].strip('()').split(','))
+    places_radar_result = get_radar_result(location, row['radius'],
+                                           row['type'])
+    if places_radar_result is None:
+        return None
+
+    if type(places_radar_result) is not dict:
+        return (False, dumps(places_radar_result))
+
+    return (True, (row['location'], row['radius'], row['type'],
+                   dumps(places_radar_result), datetime.now(),
+                   datetime.now()))
+
+
+def retry_place_details(row):
+    place_id, language = row['place_id'], row['language']
+    place_details_result = place_details.get_place_details_result(
+        place_id, language)
+    if place_details_result is None:
+        return None
+
+    if type(place_details_result) is not dict:
+        return (False, dumps(place_details_result))
+
+    store_place_details(PLACE_DETAILS_TABLE, place_id, language,
+                        place_details_result, place_details.fields)
+    return (True, None)
+
+
+def retry_place_photo(row):
+    result = get_place_photo_result(row['photo_reference'])
+    if result is None:
+        return None
+
+    place_photo_result, success = result
+    if not success:
+        return (False, place_photo_result)
+
+    return (True, (row['photo_reference'], place_photo_result))
+
+
+def get_failed_rows(kind):
+    if kind == 'radar':
+        # radar_searchs_failed has the same auto increment id as radar_searchs
+        return FailedRows(
+            RADAR_SEARCHS_FAILED_TABLE, ('id', ),
+            ('id', 'location', 'radius', 'type'),
+            "INSERT INTO `" + RADAR_SEARCHS_TABLE + "` (`location`, `radius`, `type`, `results`, `created_at`, `updated_at`) VALUES (%s, %s, %s, %s, %s, %s)",
+            retry_radar_search)
+
+    if kind == 'details':
+        return FailedRows(
+            PLACE_DETAILS_FAILED_TABLE, ('place_id', 'language'),
+            ('place_id', 'language'), None, retry_place_details)
+
+    return FailedRows(
+        PLACE_PHOTOS_FAILED_TABLE, ('photo_reference', ),
+        ('photo_reference', ),
+        "INSERT INTO `" + PLACE_PHOTOS_TABLE + "` (`photo_reference`, `results`) VALUES (%s, %s) ON DUPLICATE KEY UPDATE `results` = VALUES(`results`)",
+        retry_place_photo)
+
+
+def retry_failed(failed_rows, chunk_size, concurrency):
+    moved_count = 0
+    failed_count = 0
+
+    for rows in failed_rows.iter_chunks(chunk_size):
+        moved = []
+        failed = []
+
+        def retry_row(row):
+            outcome = failed_rows.retry(row)
+            if outcome is None:
+                return
+
+            success, values = outcome
+            # list.append is atomic, so the worker threads can share these
+            if success:
+                moved.append((failed_rows.key_of(row), values))
+            else:
+                failed.append((failed_rows.key_of(row), values))
+
+        try:
+            run_bounded(retry_row, rows, concurrency)
+        finally:
+            failed_rows.commit(moved, failed)
+
+        moved_count += len(moved)
+        failed_count += len(failed)
+        print("Retried", len(rows), "failed rows:", len(moved), "moved,",
+              len(failed), "still failing", datetime.now())
+
+    print("Done:", moved_count, "moved,", failed_count, "still failing")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'kind',
+        help='The failed table to retry',
+        choices=('radar', 'details', 'photos'))
+    parser.add_argument(
+        '-c', help='The number of requests kept in flight', default='8')
+    parser.add_argument(
+        '--chunk',
+        help='The number of failed rows moved per transaction',
+        default='500')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL") or "INFO",
+        format="%(asctime)s %(levelname)s %(message)s")
+    start_metrics()
+
+    place_details.fields = parse_fields(place_details.PLACE_DETAILS_FIELDS)
+
+    retry_failed(get_failed_rows(args.kind), int(args.chunk), int(args.c))
+
+
+if __name__ == "__main__":
+    main()
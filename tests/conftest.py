@@ -0,0 +1,5 @@
+import sys
+from os.path import dirname, join
+
+# The scripts are top level modules of the repository
+sys.path.insert(0, join(dirname(__file__), '..'))
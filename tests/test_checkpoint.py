@@ -0,0 +1,70 @@
+import pytest
+
+from checkpoint import CheckpointJournal
+
+
+def test_resumes_from_the_marked_entries(tmp_path):
+    path = str(tmp_path / "journal")
+    journal = CheckpointJournal(path, "plan-1")
+    journal.mark(0, 'cafe')
+    journal.mark(0, 'bar')
+    journal.mark(3, 'cafe')
+    journal.close()
+
+    journal = CheckpointJournal(path, "plan-1")
+
+    assert journal.is_cell_done(0, ['cafe', 'bar'])
+    assert journal.is_done(3, 'cafe')
+    assert not journal.is_done(3, 'bar')
+    assert not journal.is_cell_done(3, ['cafe', 'bar'])
+    journal.close()
+
+
+def test_drops_a_partial_last_line(tmp_path):
+    path = str(tmp_path / "journal")
+    journal = CheckpointJournal(path, "plan-1")
+    journal.mark(1, 'cafe')
+    journal.close()
+
+    with open(path, 'a') as journal_file:
+        journal_file.write("2\tca")
+
+    journal = CheckpointJournal(path, "plan-1")
+    journal.mark(2, 'bar')
+    journal.close()
+
+    with open(path) as journal_file:
+        assert journal_file.read() == "# plan plan-1\n1\tcafe\n2\tbar\n"
+
+    journal = CheckpointJournal(path, "plan-1")
+    assert journal.is_done(1, 'cafe')
+    assert journal.is_done(2, 'bar')
+    assert not journal.is_done(2, 'cafe')
+    journal.close()
+
+
+def test_rejects_the_journal_of_another_plan(tmp_path):
+    path = str(tmp_path / "journal")
+    CheckpointJournal(path, "plan-1").close()
+
+    with pytest.raises(ValueError):
+        CheckpointJournal(path, "plan-2")
+
+
+def test_runs_before_sync_before_the_entries_are_synced(tmp_path):
+    calls = []
+    journal = CheckpointJournal(
+        str(tmp_path / "journal"),
+        "plan-1",
+        sync_every=2,
+        sync_interval=3600,
+        before_sync=lambda: calls.append('flush'))
+    calls.clear()
+
+    journal.mark(0, 'cafe')
+    assert calls == []
+
+    journal.mark(0, 'bar')
+    assert calls == ['flush']
+    assert journal.pending == 0
+    journal.close()
@@ -0,0 +1,63 @@
+import math
+
+import numpy as np
+import pytest
+
+from coverage import METERS_PER_DEGREE, circles_intersect, hex_centers
+
+
+@pytest.mark.parametrize('lat', [-6.3, 45.0, 65.0])
+def test_hex_centers_cover_the_box(lat):
+    radius = 125
+    lat_end = lat + 0.01
+    lng_start, lng_end = 106.7, 106.72
+    center_lats, center_lngs = hex_centers(lat, lng_start, lat_end, lng_end,
+                                           radius)
+
+    sample_lats, sample_lngs = np.meshgrid(
+        np.linspace(lat, lat_end, 40),
+        np.linspace(lng_start, lng_end, 40),
+        indexing='ij')
+    scale_x = METERS_PER_DEGREE * math.cos(math.radians(lat))
+    dy = (sample_lats.ravel()[:, None] - center_lats[None, :]) * METERS_PER_DEGREE
+    dx = (sample_lngs.ravel()[:, None] - center_lngs[None, :]) * scale_x
+    nearest = np.sqrt(dx**2 + dy**2).min(axis=1)
+
+    # Allow for the longitude spacing being computed per row
+    assert nearest.max() <= radius * 1.01
+
+
+def test_hex_centers_are_sparser_than_a_square_grid():
+    radius = 125
+    center_lats, _ = hex_centers(-6.3, 106.7, -6.29, 106.72, radius)
+    step = radius * math.sqrt(2) / METERS_PER_DEGREE
+    square_count = math.ceil(0.01 / step) * math.ceil(
+        0.02 * math.cos(math.radians(-6.3)) / step)
+
+    assert len(center_lats) < square_count
+
+
+def square(lat, lng, size):
+    return np.array([[lng, lat], [lng + size, lat], [lng + size, lat + size],
+                     [lng, lat + size], [lng, lat]])
+
+
+def test_circles_intersect_inside_near_and_outside():
+    polygons = [[square(0.0, 0.0, 0.01)]]
+    offset = 100 / METERS_PER_DEGREE
+    lats = [0.005, 0.005, 0.005]
+    # Inside, 100 m outside the east edge, and far to the east
+    lngs = [0.005, 0.01 + offset, 0.05]
+
+    mask = circles_intersect(lats, lngs, 125, polygons)
+
+    assert mask.tolist() == [True, True, False]
+
+
+def test_circles_intersect_honours_holes():
+    polygons = [[square(0.0, 0.0, 0.1), square(0.04, 0.04, 0.02)]]
+
+    # The middle of the hole is more than 1 km from its edges
+    mask = circles_intersect([0.05, 0.02], [0.05, 0.02], 125, polygons)
+
+    assert mask.tolist() == [False, True]
@@ -0,0 +1,25 @@
+from dedup import iter_unique
+
+
+def test_yields_in_first_seen_order_in_memory():
+    items = ['b', 'a', 'b', 'c', 'a']
+
+    assert list(iter_unique(items, max_in_memory=10)) == ['b', 'a', 'c']
+
+
+def test_spills_to_disk_without_repeating_items():
+    items = ['e', 'a', 'e', 'd', 'a', 'c', 'b', 'd', 'f', 'c', 'a', 'g', 'b']
+
+    unique = list(iter_unique(items, max_in_memory=2))
+
+    assert sorted(unique) == sorted(set(items))
+    assert len(unique) == len(set(items))
+    # The items seen before the spill come out first, as they were seen
+    assert unique[:2] == ['e', 'a']
+    assert unique[2:] == sorted(unique[2:])
+
+
+def test_spill_skips_items_already_yielded():
+    items = ['a', 'b', 'a', 'b', 'c', 'a']
+
+    assert list(iter_unique(items, max_in_memory=2)) == ['a', 'b', 'c']
@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+
+import fetched_index
+from fetched_index import BloomFilter, FetchedIndex
+
+
+class FakeCursor:
+    def __init__(self, rows, queries):
+        self.rows = rows
+        self.queries = queries
+        self.row = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, sql, args):
+        self.queries.append(args)
+        self.row = {'1': 1} if tuple(args) in self.rows else None
+
+    def fetchone(self):
+        return self.row
+
+
+class FakePool:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    @contextmanager
+    def connection(self):
+        pool = self
+
+        class Connection:
+            def cursor(self):
+                return FakeCursor(pool.rows, pool.queries)
+
+        yield Connection()
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000)
+    keys = ["place-" + str(i) for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+
+    assert all(key in bloom for key in keys)
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom = BloomFilter(1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add("place-" + str(i))
+
+    false_positives = sum("other-" + str(i) in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_contains_skips_the_database_on_a_bloom_miss(monkeypatch):
+    pool = FakePool(rows=set())
+    monkeypatch.setattr(fetched_index, 'get_mysql_pool', lambda: pool)
+    index = FetchedIndex('place_details', ('place_id', 'language'), 1000)
+
+    assert not index.contains(('a', 'en'))
+    assert pool.queries == []
+
+
+def test_contains_trusts_keys_added_in_this_run(monkeypatch):
+    pool = FakePool(rows=set())
+    monkeypatch.setattr(fetched_index, 'get_mysql_pool', lambda: pool)
+    index = FetchedIndex('place_details', ('place_id', 'language'), 1000)
+
+    index.add(('a', 'en'))
+
+    assert index.contains(('a', 'en'))
+    assert pool.queries == []
+
+
+def test_contains_confirms_a_bloom_hit_in_the_database(monkeypatch):
+    pool = FakePool(rows={('a', 'en')})
+    monkeypatch.setattr(fetched_index, 'get_mysql_pool', lambda: pool)
+    index = FetchedIndex('place_details', ('place_id', 'language'), 1000)
+    index.bloom.add(index.encode(('a', 'en')))
+    index.bloom.add(index.encode(('b', 'en')))
+
+    assert index.contains(('a', 'en'))
+    # A false positive of the filter doesn't skip the request
+    assert not index.contains(('b', 'en'))
+    assert pool.queries == [('a', 'en'), ('b', 'en')]
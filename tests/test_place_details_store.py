@@ -0,0 +1,61 @@
+import place_details_store
+
+
+class FakeBatchWriter:
+    def __init__(self):
+        self.rows = []
+
+    def add(self, *row):
+        self.rows.append(row)
+
+
+class FakeFetchedIndex:
+    def __init__(self):
+        self.keys = set()
+
+    def add(self, key):
+        self.keys.add(key)
+
+
+def patch_store(monkeypatch, fetched_index, compressed):
+    writers = {}
+
+    def get_batch_writer(table, columns, update_columns=()):
+        return writers.setdefault(table, FakeBatchWriter())
+
+    monkeypatch.setattr(place_details_store, 'get_batch_writer',
+                        get_batch_writer)
+    monkeypatch.setattr(place_details_store, 'insert_photo_references',
+                        lambda *args: writers.setdefault('refs', args))
+    monkeypatch.setattr(place_details_store, 'find_fetched_index',
+                        lambda table: fetched_index)
+    monkeypatch.setattr(place_details_store, 'is_compression_enabled',
+                        lambda: compressed)
+    return writers
+
+
+def test_store_clears_the_compressed_copy(monkeypatch):
+    fetched_index = FakeFetchedIndex()
+    writers = patch_store(monkeypatch, fetched_index, compressed=False)
+    result = {'status': 'OK', 'result': {'name': 'A', 'rating': 4}}
+
+    stored = place_details_store.store_place_details(
+        'place_details', 'p1', 'ja', result, ['name'])
+
+    assert stored == {'status': 'OK', 'result': {'name': 'A'}}
+    row, = writers['place_details'].rows
+    assert row[:2] == ('p1', 'ja')
+    assert row[3] is None
+    assert writers['refs'] == ('p1', 'ja', stored)
+    assert fetched_index.keys == {('p1', 'ja')}
+
+
+def test_store_compresses_and_works_without_an_index(monkeypatch):
+    writers = patch_store(monkeypatch, None, compressed=True)
+
+    place_details_store.store_place_details(
+        'place_details', 'p1', 'ja', {'status': 'OK', 'result': {}}, None)
+
+    row, = writers['place_details'].rows
+    assert row[2] is None
+    assert row[3] is not None
@@ -0,0 +1,91 @@
+import pytest
+
+from place_fields import (build_mask, parse_fields, project,
+                          project_place_details, request_fields)
+
+
+def test_parse_fields():
+    assert parse_fields(None) is None
+    assert parse_fields(" , ") is None
+    assert parse_fields("name, geometry/location,photo") == [
+        'name', 'geometry/location', 'photo'
+    ]
+
+
+def test_parse_fields_rejects_unknown_fields():
+    with pytest.raises(ValueError):
+        parse_fields("name,nonsense/location")
+
+
+def test_request_fields_are_the_top_level_fields():
+    fields = ['name', 'geometry/location', 'geometry/viewport', 'photo']
+
+    assert request_fields(fields) == ['name', 'geometry', 'photo']
+
+
+def test_build_mask_uses_the_response_keys():
+    assert build_mask(['name', 'geometry/location', 'photo']) == {
+        'name': {},
+        'geometry': {
+            'location': {}
+        },
+        'photos': {},
+    }
+
+
+def test_build_mask_whole_field_wins_over_a_path():
+    assert build_mask(['geometry/location', 'geometry']) == {'geometry': {}}
+    assert build_mask(['geometry', 'geometry/location']) == {'geometry': {}}
+
+
+def test_project_keeps_only_the_masked_keys():
+    result = {
+        'name': "Cafe",
+        'rating': 4.5,
+        'geometry': {
+            'location': {
+                'lat': 1,
+                'lng': 2
+            },
+            'viewport': {}
+        },
+        'photos': [{
+            'photo_reference': "abc",
+            'width': 10
+        }],
+    }
+    mask = build_mask(['name', 'geometry/location', 'photo/photo_reference'])
+
+    assert project(result, mask) == {
+        'name': "Cafe",
+        'geometry': {
+            'location': {
+                'lat': 1,
+                'lng': 2
+            }
+        },
+        'photos': [{
+            'photo_reference': "abc"
+        }],
+    }
+
+
+def test_project_place_details_keeps_the_envelope():
+    place_details_result = {
+        'html_attributions': [],
+        'status': 'OK',
+        'result': {
+            'name': "Cafe",
+            'rating': 4.5
+        },
+    }
+
+    assert project_place_details(place_details_result, ['name']) == {
+        'html_attributions': [],
+        'status': 'OK',
+        'result': {
+            'name': "Cafe"
+        },
+    }
+    assert project_place_details(place_details_result,
+                                 None) is place_details_result
@@ -0,0 +1,58 @@
+import pytest
+
+from rate_limiter import KeyHealth, KeyRateLimiter, QuotaExhaustedError
+
+
+def test_acquire_prefers_the_key_with_the_most_tokens():
+    rate_limiter = KeyRateLimiter(['a', 'b'], qps=0.001, burst=3)
+
+    keys = [rate_limiter.acquire() for _ in range(6)]
+
+    assert sorted(keys) == ['a', 'a', 'a', 'b', 'b', 'b']
+    # Least-loaded first alternates between the keys
+    assert keys[0] != keys[1]
+
+
+def test_quarantined_keys_are_skipped():
+    rate_limiter = KeyRateLimiter(['a', 'b'], qps=1000, burst=10)
+
+    rate_limiter.report('a', 'OVER_QUERY_LIMIT')
+
+    assert [rate_limiter.acquire() for _ in range(5)] == ['b'] * 5
+
+
+def test_a_success_resets_the_failures():
+    rate_limiter = KeyRateLimiter(['a'], qps=1000, cooldown=0)
+
+    rate_limiter.report('a', 'REQUEST_DENIED')
+    rate_limiter.report('a', 'HTTP_429')
+    assert rate_limiter.health['a'].failures == 2
+
+    rate_limiter.report('a', 'OK')
+    assert rate_limiter.health['a'].failures == 0
+
+
+def test_other_statuses_do_not_quarantine():
+    rate_limiter = KeyRateLimiter(['a', 'b'], qps=1000, burst=10)
+
+    rate_limiter.report('a', 'NOT_FOUND')
+    rate_limiter.report('a', 'HTTP_500')
+
+    assert 'a' in {rate_limiter.acquire() for _ in range(4)}
+
+
+def test_quarantine_doubles_up_to_the_limit():
+    health = KeyHealth(cooldown=30, max_cooldown=100)
+
+    assert [health.fail(0) for _ in range(4)] == [30, 60, 100, 100]
+    assert not health.is_healthy(99)
+    assert health.is_healthy(100)
+
+
+def test_exhausted_daily_quota_raises():
+    rate_limiter = KeyRateLimiter(['a', 'b'], qps=1000, burst=10,
+                                  daily_quota=1)
+
+    assert sorted([rate_limiter.acquire(), rate_limiter.acquire()]) == ['a', 'b']
+    with pytest.raises(QuotaExhaustedError):
+        rate_limiter.acquire()
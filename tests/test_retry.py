@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+import pytest
+
+import retry
+
+
+class FakeRateLimiter:
+    def __init__(self):
+        self.reports = []
+
+    def acquire(self):
+        return 'key'
+
+    def report(self, key, status):
+        self.reports.append(status)
+
+
+@pytest.mark.parametrize('status, final', [
+    ('NOT_FOUND', True),
+    ('HTTP_400', True),
+    ('HTTP_404', True),
+    ('HTTP_403', False),
+    ('HTTP_429', False),
+    ('HTTP_500', False),
+    ('OVER_QUERY_LIMIT', False),
+])
+def test_is_final(status, final):
+    assert retry.is_final(status) == final
+
+
+def test_a_photo_client_error_is_not_retried(monkeypatch):
+    rate_limiter = FakeRateLimiter()
+    monkeypatch.setattr(retry, 'get_rate_limiter', lambda: rate_limiter)
+    monkeypatch.setattr(retry, 'sleep', lambda seconds: None)
+    response = SimpleNamespace(headers={}, status_code=404)
+
+    result = retry.request_with_retries(
+        'photo', lambda key: response, response_status=retry.redirect_status)
+
+    assert result == ("Unexpected error:HTTP_404", False)
+    assert rate_limiter.reports == ['HTTP_404']
+
+
+def test_a_server_error_is_retried(monkeypatch):
+    rate_limiter = FakeRateLimiter()
+    monkeypatch.setattr(retry, 'get_rate_limiter', lambda: rate_limiter)
+    monkeypatch.setattr(retry, 'sleep', lambda seconds: None)
+    monkeypatch.setenv('RETRY_ATTEMPTS', '3')
+    responses = [
+        SimpleNamespace(headers={}, status_code=500),
+        SimpleNamespace(headers={'Location': 'https://photo'}, status_code=302),
+    ]
+
+    response, success = retry.request_with_retries(
+        'photo', lambda key: responses.pop(0),
+        response_status=retry.redirect_status)
+
+    assert success
+    assert response.headers['Location'] == 'https://photo'
+    assert rate_limiter.reports == ['HTTP_500', 'OK']
@@ -0,0 +1,129 @@
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime
+
+from batch_writer import flush_all
+from mysql_pool import get_mysql_pool
+
+"""
+CREATE TABLE `work_leases` (
+  `job` varchar(191) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `chunk_start` bigint NOT NULL,
+  `chunk_end` bigint NOT NULL,
+  `owner` varchar(255) COLLATE utf8mb4_unicode_ci DEFAULT NULL,
+  `lease_expires_at` datetime DEFAULT NULL,
+  `done_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`job`,`chunk_start`),
+  KEY `claimable` (`job`,`done_at`,`lease_expires_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+"""
+
+
+class WorkLease:
+    """Claims chunks of a job from the work_leases table.
+
+    A claimed chunk is leased for `lease_timeout` seconds and the lease is
+    renewed by a heartbeat while the chunk is being worked on.  Chunks whose
+    lease ran out without being marked done are handed out again.
+    """
+
+    def __init__(self, job, lease_timeout=300):
+        self.job = job
+        self.table = os.environ.get("WORK_LEASES_TABLE") or "work_leases"
+        self.lease_timeout = lease_timeout
+        self.owner = socket.gethostname() + ":" + str(
+            os.getpid()) + ":" + uuid.uuid4().hex[:8]
+
+    def execute(self, sql, args):
+        with get_mysql_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                rowcount = cursor.execute(sql, args)
+            connection.commit()
+
+        return rowcount
+
+    def ensure_chunks(self, start, end, chunk_size):
+        chunks = [(self.job, chunk_start, min(chunk_start + chunk_size - 1, end))
+                  for chunk_start in range(start, end + 1, chunk_size)]
+
+        with get_mysql_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                sql = "INSERT IGNORE INTO `" + self.table + "` (`job`, `chunk_start`, `chunk_end`) VALUES (%s, %s, %s)"
+                cursor.executemany(sql, chunks)
+            connection.commit()
+
+    def claim(self):
+        with get_mysql_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                sql = "SELECT `chunk_start`, `chunk_end` FROM `" + self.table + "` WHERE `job`=%s AND `done_at` IS NULL AND (`lease_expires_at` IS NULL OR `lease_expires_at` < NOW()) ORDER BY `chunk_start` LIMIT 1 FOR UPDATE SKIP LOCKED"
+                cursor.execute(sql, (self.job, ))
+                chunk = cursor.fetchone()
+
+                if chunk is not None:
+                    sql = "UPDATE `" + self.table + "` SET `owner`=%s, `lease_expires_at`=NOW() + INTERVAL %s SECOND WHERE `job`=%s AND `chunk_start`=%s"
+                    cursor.execute(sql, (self.owner, self.lease_timeout,
+                                         self.job, chunk['chunk_start']))
+            connection.commit()
+
+        if chunk is None:
+            return None
+
+        return (chunk['chunk_start'], chunk['chunk_end'])
+
+    def renew(self, chunk_start):
+        sql = "UPDATE `" + self.table + "` SET `lease_expires_at`=NOW() + INTERVAL %s SECOND WHERE `job`=%s AND `chunk_start`=%s AND `owner`=%s AND `done_at` IS NULL"
+        return self.execute(
+            sql, (self.lease_timeout, self.job, chunk_start, self.owner))
+
+    def complete(self, chunk_start):
+        # The chunk's results must be stored before it is marked done
+        flush_all()
+
+        sql = "UPDATE `" + self.table + "` SET `done_at`=NOW() WHERE `job`=%s AND `chunk_start`=%s AND `owner`=%s"
+        self.execute(sql, (self.job, chunk_start, self.owner))
+
+    def release(self, chunk_start):
+        sql = "UPDATE `" + self.table + "` SET `owner`=NULL, `lease_expires_at`=NULL WHERE `job`=%s AND `chunk_start`=%s AND `owner`=%s AND `done_at` IS NULL"
+        self.execute(sql, (self.job, chunk_start, self.owner))
+
+    def heartbeat(self, chunk_start, stopped):
+        while not stopped.wait(self.lease_timeout / 3):
+            try:
+                if not self.renew(chunk_start):
+                    print("Lost the lease of chunk", chunk_start)
+            except Exception as error:
+                print("Heartbeat failed:", repr(error))
+
+    def iter_chunks(self):
+        while True:
+            chunk = self.claim()
+            if chunk is None:
+                return
+
+            chunk_start, chunk_end = chunk
+            print("=== Leased", self.job, "chunk:", chunk_start, "-",
+                  chunk_end, datetime.now(), "===")
+
+            stopped = threading.Event()
+            heartbeat = threading.Thread(
+                target=self.heartbeat, args=(chunk_start, stopped), daemon=True)
+            heartbeat.start()
+
+            try:
+                yield chunk
+            except BaseException:
+                self.release(chunk_start)
+                raise
+            finally:
+                stopped.set()
+
+            self.complete(chunk_start)
+
+
+def iter_leased_ranges(job, start, end, chunk_size, lease_timeout=300):
+    """Yield inclusive (start, end) ranges of `job` claimed by this worker."""
+    work_lease = WorkLease(job, lease_timeout)
+    work_lease.ensure_chunks(start, end, chunk_size)
+    return work_lease.iter_chunks()